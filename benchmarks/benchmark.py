@@ -0,0 +1,302 @@
+#!/usr/bin/python3
+
+# imported modules
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image, ImageChops
+from requests.adapters import HTTPAdapter
+from requests.utils import requote_uri
+import argparse
+import contextlib
+import gc
+import glob
+import importlib
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+# configuration constants
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE_DIRECTORY = os.path.join(REPO_DIRECTORY, 'benchmarks', 'fixtures')
+ENGINE_DIRECTORY = os.path.join(REPO_DIRECTORY, 'shared')
+GAME_NAMES = ('lol', 'dota') # each one a directory with the game's shopkeeper.py and its examples
+
+
+# main: records the wiki pages and images the example builds need into fixtures (along with what they render to), or benchmarks
+# rendering the examples from those fixtures
+def main(sys_argv):
+	argument_parser = argparse.ArgumentParser(description = 'Benchmarks rendering the example builds against recorded wiki fixtures.')
+	argument_parser.add_argument('command', choices = ('record', 'run'), help = 'record the fixtures from the wikis, or run the benchmark against them')
+	argument_parser.add_argument('-g', '--games', nargs = '+', choices = GAME_NAMES, default = list(GAME_NAMES), help = 'which games to record or benchmark')
+	argument_parser.add_argument('-r', '--repeat', type = int, default = 5, help = 'how many timed rounds to run, after one untimed warmup round')
+	argument_parser.add_argument('--references', metavar = 'DIRECTORY', help = 'where the .png files to compare the renders with are, instead of the ones recorded with the fixtures')
+	argument_parser.add_argument('--report', metavar = 'REPORT', help = 'where to write every timing and comparison as json')
+	arguments = argument_parser.parse_args(sys_argv[1:])
+
+	if arguments.command == 'record':
+		sys.exit(record_fixtures(arguments.games))
+
+	benchmark_results = {}
+	for game_name in GAME_NAMES:
+		if game_name in arguments.games:
+			benchmark_results[game_name] = benchmark_game(game_name, arguments.repeat, arguments.references or os.path.join(FIXTURE_DIRECTORY, game_name))
+	for game_name, game_results in benchmark_results.items():
+		print_results(game_name, game_results)
+
+	if arguments.report:
+		with open(arguments.report, 'w') as report_filehandle:
+			json.dump(benchmark_results, report_filehandle, indent = '\t')
+	all_matched = all(game_results and all(pixel_count == 0 for pixel_count in game_results['differences'].values()) for game_results in benchmark_results.values())
+	sys.exit(0 if all_matched else 1)
+
+
+# record_fixtures: snapshots every page and image the example builds of the given games use into an asset bundle for each game
+# in FIXTURE_DIRECTORY, which is the only part of the benchmark that needs the wikis, and then renders the examples from just that
+# bundle into a directory of reference .png files next to it; the fixtures get committed, so every machine benchmarks (and compares
+# against) the same pages and images, however much the wikis have changed since
+def record_fixtures(game_names):
+	if not os.path.isdir(FIXTURE_DIRECTORY):
+		os.makedirs(FIXTURE_DIRECTORY)
+	exit_code = 0
+	for game_name in game_names:
+		bundle_filepath = os.path.join(FIXTURE_DIRECTORY, '%s.bundle' % game_name)
+		example_filepaths = sorted(glob.glob(os.path.join(REPO_DIRECTORY, game_name, 'examples', '*.json')))
+		engine, game_plugin = load_game(game_name, tempfile.mkdtemp(), None)
+		if engine.snapshot_main(game_plugin, [bundle_filepath] + example_filepaths):
+			exit_code = 1
+			continue
+		exit_code = record_references(game_name, bundle_filepath, example_filepaths) or exit_code
+	return exit_code
+
+
+# record_references: renders the builds at example_filepaths for game_name into the reference directory for that game in FIXTURE_DIRECTORY
+# (replacing whatever was there) through a fixture server for the bundle at bundle_filepath, the same way the benchmark does,
+# so the benchmark has renders of exactly its fixtures to compare with
+def record_references(game_name, bundle_filepath, example_filepaths):
+	reference_directory = os.path.join(FIXTURE_DIRECTORY, game_name)
+	shutil.rmtree(reference_directory, True)
+	os.makedirs(reference_directory)
+	engine, game_plugin = load_game(game_name, tempfile.mkdtemp(), None)
+	fixture_server = start_fixture_server(engine.load_asset_bundle(bundle_filepath))
+	try:
+		engine, game_plugin = load_game(game_name, tempfile.mkdtemp(), 'http://%s:%d' % fixture_server.server_address[:2])
+		with contextlib.redirect_stdout(io.StringIO()):
+			render_results = engine.render_builds(game_plugin, example_filepaths, 1, { 'output': reference_directory })
+	finally:
+		fixture_server.shutdown()
+		fixture_server.server_close()
+	failed_filepaths = [input_filepath for input_filepath, render_error in render_results if render_error]
+	if failed_filepaths:
+		print('Error: could not render the %s references for %s.' % (game_name, ', '.join(failed_filepaths)))
+		return 1
+	print('Success: rendered %d %s references into "%s".' % (len(render_results), game_name, reference_directory))
+	return 0
+
+
+# benchmark_game: times rendering every example of game_name from the recorded fixtures, served over http by a local stand-in for the wikis,
+# in three scenarios: cold (empty on-disk cache, fresh process state), disk (warm on-disk cache, fresh process state, like a
+# second run of the script) and memory (both warm, like a long-running render service); gives back the timings of each scenario,
+# both overall and for each draw stage, rasterize and png encode, and how many pixels of each render differ from the reference .png files
+def benchmark_game(game_name, repeat_count, reference_directory):
+	bundle_filepath = os.path.join(FIXTURE_DIRECTORY, '%s.bundle' % game_name)
+	if not os.path.exists(bundle_filepath):
+		print('Error: there are no %s fixtures yet, so run "benchmark.py record" first.' % game_name)
+		return None
+
+	work_directory = tempfile.mkdtemp()
+	input_filepaths = []
+	for example_filepath in sorted(glob.glob(os.path.join(REPO_DIRECTORY, game_name, 'examples', '*.json'))):
+		input_filepaths.append(shutil.copy(example_filepath, work_directory))
+	engine, game_plugin = load_game(game_name, os.path.join(work_directory, 'cache'), None)
+	fixture_server = start_fixture_server(engine.load_asset_bundle(bundle_filepath))
+	server_url = 'http://%s:%d' % fixture_server.server_address[:2]
+	scenario_runs = { 'cold': [], 'disk': [], 'memory': [] }
+	try:
+		for round_index in range(repeat_count + 1):
+			cache_directory = os.path.join(work_directory, 'cache-%d' % round_index)
+			round_runs = {}
+			round_runs['cold'] = time_render(*load_game(game_name, cache_directory, server_url), input_filepaths)
+			engine, game_plugin = load_game(game_name, cache_directory, server_url)
+			round_runs['disk'] = time_render(engine, game_plugin, input_filepaths)
+			round_runs['memory'] = time_render(engine, game_plugin, input_filepaths)
+			if round_index: # the first round warms up the interpreter and the file system, so it doesn't count
+				for scenario_name, scenario_run in round_runs.items():
+					scenario_runs[scenario_name].append(scenario_run)
+		return {
+			'scenarios': dict((scenario_name, summarize_runs(runs)) for scenario_name, runs in scenario_runs.items()),
+			'differences': compare_outputs(input_filepaths, reference_directory)
+		}
+	finally:
+		fixture_server.shutdown()
+		fixture_server.server_close()
+		shutil.rmtree(work_directory, True)
+
+
+# load_game: imports the engine from scratch (so nothing is left in memory from an earlier run) with its on-disk cache in cache_directory,
+# along with the plugin for game_name, sending every request to the fixture server at server_url if one is given; gives back both
+def load_game(game_name, cache_directory, server_url):
+	if ENGINE_DIRECTORY not in sys.path:
+		sys.path.insert(0, ENGINE_DIRECTORY)
+	os.environ['SHOPKEEPER_CACHE_DIRECTORY'] = cache_directory
+	os.environ.pop('SHOPKEEPER_BUNDLE', None) # every request should go over http to the fixture server
+	if 'engine' in sys.modules:
+		engine = importlib.reload(sys.modules['engine'])
+	else:
+		engine = importlib.import_module('engine')
+	game_plugin = engine.load_game_plugin(os.path.join(REPO_DIRECTORY, game_name, 'shopkeeper.py'))
+	if server_url:
+		engine.set_http_transport(FixtureAdapter(server_url))
+	return engine, game_plugin
+
+
+# time_render: renders every build at input_filepaths with the given engine module and game plugin, giving back how long it took in total
+# and in each draw stage, rasterize and png encode (from its profile spans), and how many requests it sent to the fixture server
+def time_render(engine, game_plugin, input_filepaths):
+	initial_requests = engine.CACHE_STATS['requests']
+	engine.set_profiling(True)
+	gc.collect() # so a collection of the last run's garbage doesn't land in this one
+	start_time = time.perf_counter()
+	with contextlib.redirect_stdout(io.StringIO()):
+		render_results = engine.render_builds(game_plugin, input_filepaths)
+	duration = time.perf_counter() - start_time
+	for input_filepath, render_error in render_results:
+		if render_error:
+			raise RuntimeError('could not render "%s": %s' % (input_filepath, render_error))
+
+	stage_durations = {}
+	for profile_span in engine.PROFILE_SPANS:
+		if profile_span['kind'] in ('stage', 'rasterize', 'encode'):
+			stage_name = profile_span['name'] if profile_span['kind'] == 'stage' else profile_span['kind']
+			stage_durations[stage_name] = stage_durations.get(stage_name, 0) + profile_span['duration']
+	engine.set_profiling(False)
+	return { 'duration': duration, 'stages': stage_durations, 'requests': engine.CACHE_STATS['requests'] - initial_requests }
+
+
+# summarize_runs: boils the timings of the runs of one scenario down to the median, minimum, maximum and standard deviation of their
+# durations (overall and for each stage), which hold up a lot better between benchmark runs than any single run does
+def summarize_runs(scenario_runs):
+	stage_names = sorted(set(stage_name for scenario_run in scenario_runs for stage_name in scenario_run['stages']))
+	return {
+		'runs': len(scenario_runs),
+		'requests': max(scenario_run['requests'] for scenario_run in scenario_runs),
+		'duration': summarize_durations([scenario_run['duration'] for scenario_run in scenario_runs]),
+		'stages': dict(
+			(stage_name, summarize_durations([scenario_run['stages'].get(stage_name, 0) for scenario_run in scenario_runs]))
+			for stage_name in stage_names
+		)
+	}
+
+
+# summarize_durations: gives the median, minimum, maximum and standard deviation of durations
+def summarize_durations(durations):
+	return {
+		'median': statistics.median(durations),
+		'min': min(durations),
+		'max': max(durations),
+		'stdev': statistics.stdev(durations) if len(durations) > 1 else 0.0
+	}
+
+
+# compare_outputs: counts how many pixels of the .png rendered for each of input_filepaths differ from the .png of the same name
+# in reference_directory, keyed by that name; missing files count as entirely different
+def compare_outputs(input_filepaths, reference_directory):
+	pixel_differences = {}
+	for input_filepath in input_filepaths:
+		image_name = os.path.basename(input_filepath)[:-len('.json')] + '.png'
+		try:
+			output_image = Image.open(input_filepath[:-len('.json')] + '.png').convert('RGB')
+			reference_image = Image.open(os.path.join(reference_directory, image_name)).convert('RGB')
+		except (IOError, OSError):
+			pixel_differences[image_name] = -1
+			continue
+		if output_image.size != reference_image.size:
+			pixel_differences[image_name] = max(output_image.size[0] * output_image.size[1], reference_image.size[0] * reference_image.size[1])
+			continue
+		red_difference, green_difference, blue_difference = ImageChops.difference(output_image, reference_image).split()
+		difference_mask = ImageChops.lighter(ImageChops.lighter(red_difference, green_difference), blue_difference)
+		pixel_differences[image_name] = output_image.size[0] * output_image.size[1] - difference_mask.histogram()[0]
+	return pixel_differences
+
+
+# print_results: prints the summarized timings and image comparisons for game_name
+def print_results(game_name, game_results):
+	if not game_results:
+		print('%s: failed.' % game_name)
+		return
+	for scenario_name, scenario_summary in game_results['scenarios'].items():
+		print('%s %s: %s over %d runs, %d requests.' % (
+			game_name, scenario_name, format_durations(scenario_summary['duration']), scenario_summary['runs'], scenario_summary['requests']
+		))
+		for stage_name, stage_summary in sorted(scenario_summary['stages'].items()):
+			print('  %s: %s' % (stage_name, format_durations(stage_summary)))
+	for image_name, pixel_count in sorted(game_results['differences'].items()):
+		if pixel_count == 0:
+			print('%s %s: matches the reference.' % (game_name, image_name))
+		elif pixel_count < 0:
+			print('%s %s: missing, or its reference is.' % (game_name, image_name))
+		else:
+			print('%s %s: %d pixels differ from the reference!' % (game_name, image_name, pixel_count))
+
+
+# format_durations: formats a summary from summarize_durations in milliseconds
+def format_durations(duration_summary):
+	return 'median %.1fms (min %.1fms, max %.1fms, stdev %.1fms)' % tuple(
+		duration_summary[statistic_name] * 1000 for statistic_name in ('median', 'min', 'max', 'stdev')
+	)
+
+
+# start_fixture_server: starts serving the bodies in asset_bundle (the (memory map, index) pair from load_asset_bundle) over http on
+# a free local port, in a background thread; a request for /<quoted url> gets the body bundled for that url, or a 404; the urls get
+# matched the way requests sends them, with spaces and the like already quoted (like the dota hero pages)
+def start_fixture_server(asset_bundle):
+	fixture_server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureRequestHandler)
+	fixture_server.daemon_threads = True
+	fixture_server.asset_bundle = asset_bundle
+	fixture_server.bundle_entries = dict((requote_uri(url), bundle_entry) for url, bundle_entry in asset_bundle[1]['entries'].items())
+	threading.Thread(target = fixture_server.serve_forever, daemon = True).start()
+	return fixture_server
+
+
+# FixtureRequestHandler: answers a request to the fixture server (see start_fixture_server)
+class FixtureRequestHandler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1' # so connections get kept alive, like they would be with the wikis
+
+	def do_GET(self):
+		bundle_entry = self.server.bundle_entries.get(urllib.parse.unquote(self.path[1:]))
+		if bundle_entry is None:
+			self.send_response(404)
+			self.send_header('Content-Length', '0')
+			self.end_headers()
+			return
+		entry_offset, entry_length = bundle_entry
+		self.send_response(200)
+		self.send_header('Content-Type', 'application/octet-stream')
+		self.send_header('Content-Length', str(entry_length))
+		self.end_headers()
+		self.wfile.write(self.server.asset_bundle[0][entry_offset:entry_offset + entry_length])
+
+	def log_message(self, *arguments):
+		pass # a line per request would drown out the results
+
+
+# FixtureAdapter: a transport adapter that sends every request to the fixture server at server_url instead of wherever it was going,
+# with the original url quoted into the path
+class FixtureAdapter(HTTPAdapter):
+	def __init__(self, server_url):
+		super().__init__(pool_maxsize = 16)
+		self.server_url = server_url
+
+	def send(self, request, **keyword_arguments):
+		request.url = '%s/%s' % (self.server_url, urllib.parse.quote(request.url, safe = ''))
+		return super().send(request, **keyword_arguments)
+
+
+# standard ifmain with args
+if __name__ == '__main__':
+	main(sys.argv)
@@ -1,263 +1,235 @@
-#!/usr/bin/python
+#!/usr/bin/python3
 
 # imported modules
-from PIL import Image, ImageDraw, ImageFont, ImageOps
-import json
+import os
 import re
-import requests
 import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+import engine # everything besides what's below is the same for every game
 
 # configuration constants
-BUILD_IMAGE_DIMENSIONS = (1920, 1080)
-BACKGROUND_ALPHA = 55
-DRAW_COLOR = (50, 50, 50)
-BACK_COLOR = (0, 0, 0)
-TEXT_COLOR = (100, 100, 100)
-TRANSPARENCY_THRESHOLD = 64
+GAME = 'League of Legends'
 LETTER_OPTIONS = ('Q', 'W', 'E', 'R')
-ABILITY_IMAGE_CHARACTER = '@' # a character that wouldn't normally show up in the ability order
-FONT_SIZES = {
-	'H1': 48,
-	'H2': 40,
-	'H3': 32,
-	'H4': 24
-}
-FONT_HEIGHT_BONUS = 2 # the font is usually drawn a few pixels short of its supposed height
-FONT_FILEPATH = '../shared/CarroisGothicSC-Regular.ttf'
 WIKI_BASE_URL = 'https://leagueoflegends.fandom.com/wiki'
 WIKI_IMAGE_URL_PATTERN = r'https://static\.wikia\.nocookie\.net/leagueoflegends/images/.+?\.(?:jpg|png)'
-ENCHANTABLE_ITEMS = ['Stalker\'s Blade', 'Skirmisher\'s Sabre', 'Pridestalker\'s Blade', 'Tracker\'s Knife',  'Ranger\'s Trailblazer',  'Poacher\'s Knife']
-
-
-# main: loads the given data from sys_argv and runs each draw function in succession to get the final image
-def main(sys_argv):
-	if len(sys_argv) < 2:
-		print('Error: no input file given.')
-		sys.exit(1)
-	elif not sys_argv[1].endswith('.json'):
-		print('Error: argument must be a .json file.')
-		sys.exit(1)
-
-	# we're gonna put the output image in the same location as the input json, just with a different extension
-	input_filepath = sys_argv[1]
-	output_filepath = re.sub(r'\.json$', '.png', input_filepath)
-
-	with open(input_filepath) as input_filehandle:
-		build_data = json.load(input_filehandle)
-
-	# the base image is pure black, then we draw each layer on top of it
-	build_image = Image.new('RGB', BUILD_IMAGE_DIMENSIONS, (0, 0, 0))
-	for draw_function in (draw_background, draw_metadata, draw_summoner_spells, draw_runes, draw_abilities, draw_items):
-		build_image = draw_function(build_image, build_data)
-		print("Finished step: " + draw_function.__name__)
-
-	if build_image:
-		build_image.save(output_filepath)
-		print('Success: created "%s" from "%s".' % (output_filepath, input_filepath))
-		sys.exit(0)
-	else:
-		print('Error: something went wrong while creating the build image. Perhaps malformed data?')
-		sys.exit(1)
-
-
-# draw_background: gets the skin image for the loaded build_data and draws it on build_image as the background
-def draw_background(build_image, build_data):
-	skin_images = get_images(
-		'/'.join((WIKI_BASE_URL, build_data.get('Champion'), 'Skins')),
-		re.compile(r'data-skin="(.*?)"><a href="(%s)' % WIKI_IMAGE_URL_PATTERN)
-	)
-	skin_image = skin_images.get(build_data.get('Skin').replace('\'', '&#39;'))
-
-	if skin_image:
-		# scale the skin image to fit the width of the build image
-		image_width, image_height = skin_image.size
-		scale_ratio = float(BUILD_IMAGE_DIMENSIONS[0]) / image_width
-		skin_image = skin_image.resize((int(image_width * scale_ratio), int(image_height * scale_ratio)))
-
-		# then center and crop the skin image to fit the height of the build image
-		image_width, image_height = skin_image.size
-		height_difference = image_height - BUILD_IMAGE_DIMENSIONS[1]
-		top_cut = height_difference / 2
-		bottom_cut = height_difference - top_cut
-		skin_image = skin_image.crop((0, top_cut, BUILD_IMAGE_DIMENSIONS[0], image_height - bottom_cut))
-
-		# make it mostly transparent so it's not a distracting background
-		skin_image.putalpha(BACKGROUND_ALPHA)
-		build_image.paste(skin_image, (0, 0), skin_image)
-	return build_image
-
-
-# draw_metadata: loads the metadata text from build_data and draws them on build_image in the corners
-def draw_metadata(build_image, build_data):
-	# load our font in all of the sizes we need for the metadata
-	scaled_fonts = {}
-	for header_level, font_size in FONT_SIZES.items():
-		scaled_fonts[header_level] = ImageFont.truetype(FONT_FILEPATH, font_size)
-	metadata_drawer = ImageDraw.Draw(build_image)
-
-	# draw each of the pieces offset from the specified corner
-	for text_anchor, text_offset, metadata_type, header_level in [
-		(('left' , 'top'   ), (32, 32), 'Champion', 'H1'),
-		(('left' , 'top'   ), (32, 88), 'Role'    , 'H2'),
-		(('right', 'bottom'), (32, 32), 'Skin'    , 'H2'),
-		(('right', 'bottom'), (32, 80), 'Chroma'  , 'H3'),
-		(('left' , 'bottom'), (32, 32), 'Creator' , 'H4'),
-		(('right', 'top'   ), (32, 32), 'Patch'   , 'H4'),
-	]:
-		metadata_text = build_data.get(metadata_type)
-		if not metadata_text:
-			continue
-		scaled_font = scaled_fonts[header_level]
-		text_width, text_height = metadata_drawer.textsize(metadata_text, scaled_font)
-		text_position = (
-			0 + text_offset[0] if text_anchor[0] == 'left' else BUILD_IMAGE_DIMENSIONS[0] - (text_offset[0] + text_width ),
-			0 + text_offset[1] if text_anchor[1] == 'top'  else BUILD_IMAGE_DIMENSIONS[1] - (text_offset[1] + text_height)
-		)
-		metadata_drawer.text(text_position, metadata_text, TEXT_COLOR, scaled_font)
-	return build_image
-
-
-# draw_summoner_spells: gets the summoner spell images for the loaded build_data and draws them on build_image side by side
-def draw_summoner_spells(build_image, build_data):
-	spell_images = get_images(
-		'/'.join((WIKI_BASE_URL, 'Summoner_spell')),
-		re.compile(r'<div class="grid-image label-after spell-icon" data-param="(\w+).*?data-src="(%s)' % WIKI_IMAGE_URL_PATTERN, re.DOTALL)
+ICON_OPERATIONS = { # the preprocessing steps for each kind of icon (see engine.process_icon), which only happen once per icon
+	'Summoner Spells': (('expand', 1, engine.DRAW_COLOR),),
+	'Paths': (('threshold', engine.TRANSPARENCY_THRESHOLD),) # removes the half-transparent backgrounds of these images
+}
+PAGE_EXTRACTORS = { # extractor name -> the fields it picks out of a wiki page, in the order they come up (see engine.PageIndexParser)
+	'Skins': (
+		(None, (('data-skin', r'(.+)'),)),
+		('a', (('href', r'(%s).*' % WIKI_IMAGE_URL_PATTERN),))
+	),
+	'Summoner Spells': (
+		('div', (('class', r'grid-image label-after spell-icon'), ('data-param', r'(\w+)'))),
+		(None, (('src', r'(%s).*' % WIKI_IMAGE_URL_PATTERN),))
+	),
+	'Paths': (
+		('li', ()),
+		('img', (('alt', r'(\w+) icon\.png'),)),
+		(None, (('src', r'(%s).*' % WIKI_IMAGE_URL_PATTERN),))
+	),
+	'Runes': ( # the keystones and the other runes, which are the same images at different sizes
+		(None, (('title', r'([\w :;\']+)'),)),
+		(None, (('src', r'(%s/revision/latest/scale-to-width-down/52).*' % WIKI_IMAGE_URL_PATTERN),))
+	),
+	'Shards': (
+		(None, (('data-image-name', r'Rune shard ([\w ]+)\.png'),)),
+		(None, (('src', r'(%s/revision/latest/scale-to-width-down/30).*' % WIKI_IMAGE_URL_PATTERN),))
+	),
+	'Abilities': (
+		('div', (('class', r'skill skill_(\w)'),)),
+		(None, (('data-source', r'primary_icon'),)),
+		('a', (('href', r'(%s).*' % WIKI_IMAGE_URL_PATTERN),))
+	),
+	'Enchantments': ( # the enchantment is whatever's in parentheses in the alt text, and the image comes first
+		('img', (('src', r'(%s).*' % WIKI_IMAGE_URL_PATTERN), ('alt', r'(?:.*?\()?(.+?)(?:\).*)?'))),
+	),
+	'Items': (
+		('div', (('class', r'item-icon'),)),
+		(None, (('data-item', r'(.+)'),)),
+		(None, (('src', r'(%s).*' % WIKI_IMAGE_URL_PATTERN),))
 	)
+}
+ENCHANTABLE_ITEMS = ['Stalker\'s Blade', 'Skirmisher\'s Sabre', 'Pridestalker\'s Blade', 'Tracker\'s Knife',  'Ranger\'s Trailblazer',  'Poacher\'s Knife']
+ENCHANTMENT_REGEX = re.compile(r'^(%s) \((.*?)\)$' % '|'.join(re.escape(enchantable_item) for enchantable_item in ENCHANTABLE_ITEMS)) # any of them, with its enchantment in parentheses
+STAGE_LOOKUPS = { # the image lookups (see get_image_lookups) each draw function needs, in drawing order, so it can start drawing as soon as they're in
+	'draw_background': (), # the background usually comes out of the layer cache without needing its image at all, so it looks it up itself
+	'draw_metadata': (),
+	'draw_summoner_spells': ('Summoner Spells',),
+	'draw_runes': ('Paths', 'Keystones', 'Runes', 'Shards'),
+	'draw_abilities': ('Abilities',),
+	'draw_items': ('Items',) + tuple('%s Enchantments' % enchantable_item for enchantable_item in ENCHANTABLE_ITEMS)
+}
+METADATA_LAYOUT = [ # (anchor corner, offset from it, build data key, header level) for each piece of metadata (see engine.draw_metadata)
+	(('left' , 'top'   ), (32, 32), 'Champion', 'H1'),
+	(('left' , 'top'   ), (32, 88), 'Role'    , 'H2'),
+	(('right', 'bottom'), (32, 32), 'Skin'    , 'H2'),
+	(('right', 'bottom'), (32, 80), 'Chroma'  , 'H3'),
+	(('left' , 'bottom'), (32, 32), 'Creator' , 'H4'),
+	(('right', 'top'   ), (32, 32), 'Patch'   , 'H4'),
+]
+
+
+# draw_background: adds the skin image for the loaded build_data to draw_operations as the background; the finished layer is
+# cached for each skin and size, so rendering the same skin again skips both the skins page and the splash art download and resample,
+# which is why it gets looked up here rather than coming in build_assets with the rest
+def draw_background(draw_operations, build_data, build_assets):
+	skin_lookup = get_skin_lookup(build_data)
+	if not skin_lookup:
+		return draw_operations
+
+	# the skins page has every skin on it, but the lookup only resolves (and downloads) the one we asked for
+	draw_operations.append((
+		'background',
+		(build_data.get('Champion'), build_data.get('Skin')),
+		lambda: engine.get_images(PAGE_EXTRACTORS, *skin_lookup).get(build_data.get('Skin'))
+	))
+	return draw_operations
+
+
+# draw_metadata: loads the metadata text from build_data and adds them to draw_operations in the corners
+def draw_metadata(draw_operations, build_data, build_assets):
+	return engine.draw_metadata(draw_operations, build_data, METADATA_LAYOUT)
+
+
+# draw_summoner_spells: adds the summoner spell images in build_assets for the loaded build_data to draw_operations side by side
+def draw_summoner_spells(draw_operations, build_data, build_assets):
+	if 'Summoner Spells' not in build_assets:
+		return draw_operations
+	spell_images = build_assets['Summoner Spells']
 
 	x_offset, y_offset = 128, 256
 	for spell_name in build_data.get('Summoner Spells'):
 		spell_image = spell_images.get(spell_name)
 		if spell_image:
-			build_image.paste(ImageOps.expand(spell_image, 1, DRAW_COLOR), (x_offset, y_offset))
+			draw_operations.append(('image', spell_image, (x_offset, y_offset), False))
 			x_offset += 160
-	return build_image
+	return draw_operations
 
 
-# draw_runes: gets the rune images for the loaded build_data and draws them on build_image in two columns, keystone/primary and secondary/shards
-def draw_runes(build_image, build_data):
-	path_images = get_images(
-		'/'.join((WIKI_BASE_URL, 'Rune')),
-		re.compile(r'<li><img alt="(\w+) icon.png".*?data-src="(%s)' % WIKI_IMAGE_URL_PATTERN),
-		False
-	)
-	keystone_images = get_images(
-		'/'.join((WIKI_BASE_URL, 'Rune')),
-		re.compile(r'title="([\w :;&#]+)".*?data-src="(%s/revision/latest/scale-to-width-down/52)' % WIKI_IMAGE_URL_PATTERN),
-		False,
-		{ '52': '112' } # the image is 52px on this page, but we want it at 112px; we can't just use the base link because it's 256px there
-	)
-	rune_images = get_images(
-		'/'.join((WIKI_BASE_URL, 'Rune')),
-		re.compile(r'title="([\w :;&#]+)".*?data-src="(%s/revision/latest/scale-to-width-down/52)' % WIKI_IMAGE_URL_PATTERN),
-		False,
-		{ '52': '64' } # the image is 52px on this page, but we want it at 64px; we can't just use the base link because it's 108px there
-	)
-	shard_images = get_images(
-		'/'.join((WIKI_BASE_URL, 'Rune')),
-		re.compile(r'data-image-name="Rune shard ([\w ]+)\.png".*?data-src="(%s/revision/latest/scale-to-width-down/30)' % WIKI_IMAGE_URL_PATTERN),
-		False,
-		{ '30': '32' } # the image is 30px on this page, but we want it at 32px; we can't just use the base link because it's 35px there
-	)
+# draw_runes: adds the rune images in build_assets for the loaded build_data to draw_operations in two columns, keystone/primary and secondary/shards
+def draw_runes(draw_operations, build_data, build_assets):
+	if 'Runes' not in build_assets:
+		return draw_operations
+	path_images = build_assets['Paths']
+	keystone_images = build_assets['Keystones']
+	rune_images = build_assets['Runes']
+	shard_images = build_assets['Shards']
+	rune_data = build_data.get('Runes')
 
 	# path images
-	rune_data = build_data.get('Runes')
 	x_center_line = 128 + 1 + int(64 / 2)
 	x_offset, y_offset = x_center_line - int(85 / 2), 448
 	for path_name in rune_data.get('Paths'):
-		path_image = path_images.get(path_name.replace('\'', '&#39;'))
+		path_image = path_images.get(path_name)
 		if path_image:
-			# remove the half-transparent backgrounds of these images
-			pixel_array = path_image.load()
-			for i in range(path_image.size[0]):
-				for j in range(path_image.size[1]):
-					if pixel_array[i, j][3] < TRANSPARENCY_THRESHOLD:
-						pixel_array[i, j] = (0, 0, 0, 0)
-			build_image.paste(path_image, (x_offset, y_offset), path_image)
+			draw_operations.append(('image', path_image, (x_offset, y_offset), True))
 			x_offset += 160
 
 	# keystone image
 	x_offset = x_center_line - int(112 / 2)
 	y_offset += 85 + 32
 	keystone_name = rune_data.get('Primary')[0] # just get the keystone, we'll do the others below
-	keystone_image = keystone_images.get(keystone_name.replace('\'', '&#39;'))
+	keystone_image = keystone_images.get(keystone_name)
 	if keystone_image:
-		build_image.paste(keystone_image, (x_offset, y_offset), keystone_image)
+		draw_operations.append(('image', keystone_image, (x_offset, y_offset), True))
 
 	# primary images
 	x_offset = x_center_line - int(64 / 2)
 	y_offset += 112 + int(32 / 2)
 	for rune_name in rune_data.get('Primary')[1:]: # skip the keystone, we did that above
-		rune_image = rune_images.get(rune_name.replace('\'', '&#39;'))
+		rune_image = rune_images.get(rune_name)
 		if rune_image:
-			build_image.paste(rune_image, (x_offset, y_offset), rune_image)
+			draw_operations.append(('image', rune_image, (x_offset, y_offset), True))
 			y_offset += 64 + 32
 
 	# secondary images
 	x_offset = x_center_line - int(64 / 2) + 160
 	y_offset = 448 + 85 + 32 + 112 - 64 - 32
 	for rune_name in rune_data.get('Secondary'):
-		rune_image = rune_images.get(rune_name.replace('\'', '&#39;'))
+		rune_image = rune_images.get(rune_name)
 		if rune_image:
-			build_image.paste(rune_image, (x_offset, y_offset), rune_image)
+			draw_operations.append(('image', rune_image, (x_offset, y_offset), True))
 			y_offset += 64 + 32
 
 	# shard images
 	x_offset = x_center_line - int(32 / 2) + 160
 	y_offset += 16
 	for shard_name in rune_data.get('Shards'):
-		shard_image = shard_images.get(shard_name.replace('\'', '&#39;'))
+		shard_image = shard_images.get(shard_name)
 		if shard_image:
-			build_image.paste(shard_image, (x_offset, y_offset), shard_image)
+			draw_operations.append(('image', shard_image, (x_offset, y_offset), True))
 			y_offset += 32 + 32
 
-	return build_image
+	return draw_operations
 
 
-# draw_abilities: gets the ability images for the loaded build_data and draws them on build_image
+# draw_abilities: adds the ability images in build_assets for the loaded build_data to draw_operations
 # with level numbers and ability letters for each ability listed in the build data's ability order
-def draw_abilities(build_image, build_data):
-	ability_images = get_images(
-		'/'.join((WIKI_BASE_URL, build_data.get('Champion'), 'LoL')),
-		re.compile(r'<div class="skill skill_(\w)".*?data-source="primary_icon">\s*?<a href="(%s)' % WIKI_IMAGE_URL_PATTERN, re.DOTALL)
-	)
-	ability_drawer = ImageDraw.Draw(build_image)
-
-	x_offset, y_offset = BUILD_IMAGE_DIMENSIONS[0] - 96, 96
+def draw_abilities(draw_operations, build_data, build_assets):
+	if 'Abilities' not in build_assets:
+		return draw_operations
+	ability_images = build_assets['Abilities']
 	ability_order = build_data.get('Abilities')
-	ability_level = len(ability_order)
 
-	for ability_letter in reversed(ABILITY_IMAGE_CHARACTER + ability_order):
-		if ability_letter != ABILITY_IMAGE_CHARACTER:
-			outline_rectangle = ((x_offset - 65, y_offset), (x_offset, y_offset + 33))
-			ability_drawer.rectangle(outline_rectangle, None, DRAW_COLOR)
-			build_image = center_text(build_image, outline_rectangle, str(ability_level), 20)
+	# the outlines and level numbers only depend on how many levels there are, so they come from a cached template
+	draw_operations.append((
+		'template',
+		(GAME, 'Abilities', len(ability_order), LETTER_OPTIONS),
+		draw_ability_template([], len(ability_order))
+	))
+
+	x_offset, y_offset = engine.BUILD_IMAGE_DIMENSIONS[0] - 96, 96
+	for ability_letter in reversed(engine.ABILITY_IMAGE_CHARACTER + ability_order):
 		y_offset += 33
 
 		for letter_option in LETTER_OPTIONS:
 			outline_rectangle = ((x_offset - 65, y_offset), (x_offset, y_offset + 65))
-			ability_drawer.rectangle(outline_rectangle, None, DRAW_COLOR)
-			if ability_letter == ABILITY_IMAGE_CHARACTER:
-				build_image.paste(ability_images.get(letter_option.lower()), (x_offset - 65 + 1, y_offset + 1))
+			if ability_letter == engine.ABILITY_IMAGE_CHARACTER:
+				draw_operations.append(('image', ability_images.get(letter_option.lower()), (x_offset - 65 + 1, y_offset + 1), False))
 			elif ability_letter.upper() == letter_option:
-				build_image = center_text(build_image, outline_rectangle, letter_option, 20)
+				draw_operations.append(('centered_text', letter_option, outline_rectangle, 20))
 			y_offset += 65
 
-		ability_level -= 1
 		x_offset -= 65
 		y_offset = 96
-	return build_image
+	return draw_operations
 
 
-# draw_items: gets the item images for the loaded build_data and draws them on build_image split out by section
-def draw_items(build_image, build_data):
-	item_images = get_images(
-		'/'.join((WIKI_BASE_URL, 'Item')),
-		re.compile(r'<div class="item-icon".*?data-item="(.*?)".*?src="(%s)' % WIKI_IMAGE_URL_PATTERN, re.DOTALL)
-	)
-	item_drawer = ImageDraw.Draw(build_image)
+# draw_ability_template: adds the parts of the ability section that are the same for every build with ability_length levels
+# to template_operations, which are the outlines of every cell and the level numbers above them
+def draw_ability_template(template_operations, ability_length):
+	x_offset, y_offset = engine.BUILD_IMAGE_DIMENSIONS[0] - 96, 96
+	for ability_level in range(ability_length, -1, -1): # level 0 is the column for the ability images
+		if ability_level:
+			outline_rectangle = ((x_offset - 65, y_offset), (x_offset, y_offset + 33))
+			template_operations.append(('rectangle', outline_rectangle, None, engine.DRAW_COLOR))
+			template_operations.append(('centered_text', str(ability_level), outline_rectangle, 20))
+		y_offset += 33
+
+		for letter_option in LETTER_OPTIONS:
+			template_operations.append(('rectangle', ((x_offset - 65, y_offset), (x_offset, y_offset + 65)), None, engine.DRAW_COLOR))
+			y_offset += 65
+
+		x_offset -= 65
+		y_offset = 96
+	return template_operations
+
+
+# draw_items: adds the item images in build_assets for the loaded build_data to draw_operations split out by section
+def draw_items(draw_operations, build_data, build_assets):
+	if 'Items' not in build_assets:
+		return draw_operations
+	item_images = build_assets['Items']
+
+	# the item slots only depend on how many items are in each section, so they come from a cached template
+	section_shape = tuple(len(item_section.get('Options')) for item_section in build_data.get('Items'))
+	draw_operations.append(('template', (GAME, 'Items', section_shape), draw_item_template([], section_shape)))
 
 	ability_section_end = 97 + 33 + 65 * len(LETTER_OPTIONS) # calculate the bottom of the ability section and go from there
-	x_offset, y_offset = BUILD_IMAGE_DIMENSIONS[0] - 96, ability_section_end + 128
+	x_offset, y_offset = engine.BUILD_IMAGE_DIMENSIONS[0] - 96, ability_section_end + 128
 	for item_section in reversed(build_data.get('Items')):
 		item_options = item_section.get('Options')
 
@@ -270,83 +242,192 @@ def draw_items(build_image, build_data):
 		block_width = ((sublist_count * 2 - 1) * 65)
 		block_height = (4 * 65 + 3 * 33)
 		outline_rectangle = ((x_offset - block_width, y_offset + block_height + 33), (x_offset, y_offset + block_height + 49))
-		build_image = center_text(build_image, outline_rectangle, item_section.get('Label'), 24)
+		draw_operations.append(('centered_text', item_section.get('Label'), outline_rectangle, 24))
 
 		for option_list in reversed(option_lists):
 			# we want to vertically center any column that doesn't have the full number of items
 			y_offset += 49 * (sublist_limit - len(option_list))
 
 			for item_name in option_list:
-				outline_rectangle = ((x_offset - 65, y_offset), (x_offset, y_offset + 65))
-				item_drawer.rectangle(outline_rectangle, BACK_COLOR, DRAW_COLOR)
-
 				# we have special logic for getting enchantable item images, if they have a valid enchantment specified in parentheses
 				item_image = None
-				for enchantable_item in ENCHANTABLE_ITEMS:
-					if re.search(r'^%s \(.*?\)$' % enchantable_item, item_name):
-						enchantment_images = get_images(
-							'/'.join((WIKI_BASE_URL, enchantable_item)),
-							re.compile(r'<img (?:style="" )?src="(%s).*?".*?alt="(?:[^"]*?\()?(.+?)(?:\)[^"]*?)?"' % WIKI_IMAGE_URL_PATTERN),
-							True
-						)
-						for enchantment_name in enchantment_images.keys():
-							if item_name == '%s (%s)' % (enchantable_item, enchantment_name):
-								item_image = enchantment_images.get(enchantment_name)
-								break
-						else:
-							# fall back on using the base image if the given enchantment doesn't match any of the ones found
-							item_image = item_images.get(enchantable_item.replace('\'', '&#39;'))
-						break
+				enchantable_item, enchantment_name = get_enchantment(item_name)
+				if enchantable_item:
+					item_image = build_assets['%s Enchantments' % enchantable_item].get(enchantment_name)
+					if not item_image:
+						# fall back on using the base image if the given enchantment doesn't match any of the ones found
+						item_image = item_images.get(enchantable_item)
 				# use the base image if there's no enchantment specified
 				# which is the most likely option, since only the old jungle items have enchantments
 				else:
-					item_image = item_images.get(item_name.replace('\'', '&#39;'))
+					item_image = item_images.get(item_name)
 
 				if item_image:
-					item_mask = item_image if 'A' in item_image.mode else None
-					build_image.paste(item_image, (x_offset - 65 + 1, y_offset + 1), item_mask)
+					draw_operations.append(('image', item_image, (x_offset - 65 + 1, y_offset + 1), None))
 				y_offset += 33 + 65
 
 			x_offset -= 65 + 65
 			y_offset = ability_section_end + 128
 		x_offset -= 65
-	return build_image
-
-
-# get_images: parses the source of wiki_page for every match to image_regex, creating a mapping of the text in the first
-# capture group to the downloaded image located at the url in the second capture group; switches the key and value if
-# reverse_order is given, and applies any link_modifiers find:replace pairs to the url before downloading the image
-def get_images(wiki_page, image_regex, reverse_order = False, link_modifiers = None):
-	page_source = requests.get(wiki_page).text
-	image_links = image_regex.findall(page_source) # the regex should parse the page for paired groups in each match
-	image_map = {}
-	for image_key, image_link in image_links: # each of the pairs should be a link to an image and a way to refer to it (potentially reversed)
-		if image_key in image_map:
-			continue
-		if reverse_order:
-			image_key, image_link = image_link, image_key
-		if link_modifiers:
-			for old_regex, new_string in link_modifiers.items():
-				image_link = re.sub(old_regex, new_string, image_link)
-		image_map[image_key] = Image.open(requests.get(image_link, stream = True).raw) # we create a mapping of each key to its downloaded image
-	return image_map
-
-
-# center_text: centers draw_text in the outline_rectangle bounding box, drawing it on build_image in size font_size text
-def center_text(build_image, outline_rectangle, draw_text, font_size):
-	outline_width = outline_rectangle[1][0] - outline_rectangle[0][0]
-	outline_height = outline_rectangle[1][1] - outline_rectangle[0][1]
-	text_drawer = ImageDraw.Draw(build_image)
-	scaled_font = ImageFont.truetype(FONT_FILEPATH, font_size)
-	text_width, text_height = text_drawer.textsize(draw_text, scaled_font)
-	text_position = (
-		outline_rectangle[0][0] + int((outline_width - text_width) / 2),
-		outline_rectangle[0][1] + int((outline_height - text_height) / 2) - FONT_HEIGHT_BONUS
+	return draw_operations
+
+
+# draw_item_template: adds the slots of the item section to template_operations, which are the same for every build whose item
+# sections have the numbers of options in section_shape; the columns are laid out the same way as in draw_items
+def draw_item_template(template_operations, section_shape):
+	ability_section_end = 97 + 33 + 65 * len(LETTER_OPTIONS)
+	x_offset, y_offset = engine.BUILD_IMAGE_DIMENSIONS[0] - 96, ability_section_end + 128
+	for option_count in reversed(section_shape):
+		sublist_limit = 4
+		sublist_count = (option_count + sublist_limit - 1) // sublist_limit
+		column_lengths = [min(sublist_limit, option_count - i * sublist_limit) for i in range(sublist_count)]
+
+		for column_length in reversed(column_lengths):
+			y_offset += 49 * (sublist_limit - column_length)
+			for i in range(column_length):
+				template_operations.append(('rectangle', ((x_offset - 65, y_offset), (x_offset, y_offset + 65)), engine.BACK_COLOR, engine.DRAW_COLOR))
+				y_offset += 33 + 65
+
+			x_offset -= 65 + 65
+			y_offset = ability_section_end + 128
+		x_offset -= 65
+	return template_operations
+
+
+# get_image_lookups: describes every get_images call the draw functions make for build_data as the tuple of arguments to pass,
+# keyed by the build data section it's for, so the images a build needs can be known (and fetched) before drawing anything;
+# sections missing from build_data don't get a lookup, so their draw functions can skip them
+def get_image_lookups(build_data):
+	image_lookups = {}
+	wiki_patch = build_data.get('Patch')
+	skin_lookup = get_skin_lookup(build_data)
+	if skin_lookup:
+		image_lookups['Skin'] = skin_lookup
+
+	if build_data.get('Summoner Spells'):
+		image_lookups['Summoner Spells'] = (
+			'/'.join((WIKI_BASE_URL, 'Summoner_spell')),
+			'Summoner Spells',
+			False,
+			None,
+			set(build_data.get('Summoner Spells')),
+			ICON_OPERATIONS['Summoner Spells'],
+			wiki_patch
+		)
+
+	rune_data = build_data.get('Runes')
+	if rune_data:
+		image_lookups['Paths'] = (
+			'/'.join((WIKI_BASE_URL, 'Rune')),
+			'Paths',
+			False,
+			None,
+			set(rune_data.get('Paths')),
+			ICON_OPERATIONS['Paths'],
+			wiki_patch
+		)
+		image_lookups['Keystones'] = (
+			'/'.join((WIKI_BASE_URL, 'Rune')),
+			'Runes',
+			False,
+			{ '52': '112' }, # the image is 52px on this page, but we want it at 112px; we can't just use the base link because it's 256px there
+			set(rune_data.get('Primary')[:1]),
+			None,
+			wiki_patch
+		)
+		image_lookups['Runes'] = (
+			'/'.join((WIKI_BASE_URL, 'Rune')),
+			'Runes',
+			False,
+			{ '52': '64' }, # the image is 52px on this page, but we want it at 64px; we can't just use the base link because it's 108px there
+			set(rune_data.get('Primary')[1:] + rune_data.get('Secondary')),
+			None,
+			wiki_patch
+		)
+		image_lookups['Shards'] = (
+			'/'.join((WIKI_BASE_URL, 'Rune')),
+			'Shards',
+			False,
+			{ '30': '32' }, # the image is 30px on this page, but we want it at 32px; we can't just use the base link because it's 35px there
+			set(rune_data.get('Shards')),
+			None,
+			wiki_patch
+		)
+
+	if build_data.get('Champion') and build_data.get('Abilities'):
+		image_lookups['Abilities'] = (
+			'/'.join((WIKI_BASE_URL, build_data.get('Champion'), 'LoL')),
+			'Abilities',
+			False,
+			None,
+			set(letter_option.lower() for letter_option in LETTER_OPTIONS),
+			None,
+			wiki_patch
+		)
+
+	if build_data.get('Items'):
+		# we only want the images for the items in this build, with the enchanted ones looked up on their base item's page
+		# (all the enchantments of each base item at once), plus the base images of any enchanted items as a fallback
+		item_names = set()
+		enchantment_names = {}
+		for item_section in build_data.get('Items'):
+			for item_name in item_section.get('Options'):
+				enchantable_item, enchantment_name = get_enchantment(item_name)
+				if enchantable_item:
+					enchantment_names.setdefault(enchantable_item, set()).add(enchantment_name)
+				item_names.add(enchantable_item or item_name)
+		for enchantable_item in enchantment_names:
+			image_lookups['%s Enchantments' % enchantable_item] = (
+				'/'.join((WIKI_BASE_URL, enchantable_item)),
+				'Enchantments',
+				True,
+				None,
+				enchantment_names[enchantable_item],
+				None,
+				wiki_patch
+			)
+		image_lookups['Items'] = (
+			'/'.join((WIKI_BASE_URL, 'Item')),
+			'Items',
+			False,
+			None,
+			item_names,
+			None,
+			wiki_patch
+		)
+	return image_lookups
+
+
+# get_skin_lookup: describes the get_images call for the background of build_data like get_image_lookups does, or gives None if it
+# doesn't have one; it's separate so draw_background only reads the build data the background depends on
+def get_skin_lookup(build_data):
+	if not (build_data.get('Champion') and build_data.get('Skin')):
+		return None
+	return (
+		'/'.join((WIKI_BASE_URL, build_data.get('Champion'), 'Skins')),
+		'Skins',
+		False,
+		None,
+		set([build_data.get('Skin')]), # the skins page has every skin, but we only need the one
+		None,
+		build_data.get('Patch')
 	)
-	text_drawer.text(text_position, draw_text, TEXT_COLOR, scaled_font)
-	return build_image
+
+
+# get_enchantment: splits item_name into its enchantable base item and the enchantment given in parentheses, or gives a pair of Nones if it isn't one
+def get_enchantment(item_name):
+	enchantment_match = ENCHANTMENT_REGEX.match(item_name)
+	if enchantment_match:
+		return enchantment_match.group(1), enchantment_match.group(2)
+	return None, None
+
+
+# get_asset_urls: gives any urls the draw functions for build_data fetch directly rather than through get_image_lookups,
+# for snapshots and prefetching; every league image comes from a wiki page, so there aren't any
+def get_asset_urls(build_data):
+	return []
 
 
 # standard ifmain with args
 if __name__ == '__main__':
-	main(sys.argv)
+	engine.main(sys.argv, sys.modules[__name__])
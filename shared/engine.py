@@ -0,0 +1,1890 @@
+# engine: the rendering engine every game shares, which does the fetching, caching, page indexing, fonts, display list and compositing,
+# along with the command line; each game's shopkeeper.py is a plugin module for it, with its GAME name, its PAGE_EXTRACTORS, the
+# get_image_lookups and get_asset_urls for a build, and the draw functions named in its STAGE_LOOKUPS (in drawing order), which
+# take (draw operations, build data, build assets) and add to the draw operations (see rasterize_display_list)
+
+# imported modules
+from multiprocessing.pool import ThreadPool
+from html.parser import HTMLParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image, ImageChops, ImageDraw, ImageFont, ImageOps
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+import argparse
+import cProfile
+import collections
+import contextlib
+import contextvars
+import glob
+import hashlib
+import importlib.util
+import io
+import json
+import mmap
+import multiprocessing
+import os
+import re
+import requests
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+try:
+	import resource # only for the peak memory in profile reports and the memory limit, and it's unix only
+except ImportError:
+	resource = None
+try:
+	import fcntl # only for locking the cache index while it gets saved, and it's unix only
+except ImportError:
+	fcntl = None
+
+# configuration constants
+ENGINE_DIRECTORY = os.path.dirname(os.path.abspath(__file__)) # the shared directory, with the font in it, so nothing depends on where the script gets run from
+BUILD_IMAGE_DIMENSIONS = (1920, 1080)
+BACKGROUND_ALPHA = 55
+DRAW_COLOR = (50, 50, 50)
+BACK_COLOR = (0, 0, 0)
+TEXT_COLOR = (100, 100, 100)
+TRANSPARENCY_THRESHOLD = 64
+ABILITY_IMAGE_CHARACTER = '@' # a character that wouldn't normally show up in the ability order
+FONT_SIZES = {
+	'H1': 48,
+	'H2': 40,
+	'H3': 32,
+	'H4': 24
+}
+FONT_HEIGHT_BONUS = 2 # the font is usually drawn a few pixels short of its supposed height
+FONT_FILEPATH = os.path.join(ENGINE_DIRECTORY, 'CarroisGothicSC-Regular.ttf')
+OUTPUT_FORMATS = { # output format -> (PIL format, file extension, content type)
+	'png': ('PNG', '.png', 'image/png'),
+	'webp': ('WEBP', '.webp', 'image/webp'),
+	'jpeg': ('JPEG', '.jpg', 'image/jpeg')
+}
+OUTPUT_QUALITIES = range(1, 101) # what jpeg and webp take for quality
+OUTPUT_COMPRESS_LEVELS = range(10) # what png takes for compress_level
+MAXIMUM_OUTPUT_WIDTH = 4 * BUILD_IMAGE_DIMENSIONS[0] # past this the images are just blown up, and take ages to rasterize
+HTTP_TIMEOUT = (float(os.environ.get('SHOPKEEPER_HTTP_CONNECT_TIMEOUT', 5)), float(os.environ.get('SHOPKEEPER_HTTP_READ_TIMEOUT', 30))) # seconds
+HTTP_RETRIES = int(os.environ.get('SHOPKEEPER_HTTP_RETRIES', 3)) # how many times a failed or rate limited request gets retried
+HTTP_RETRY_BACKOFF = 0.5 # seconds, doubling with each retry
+CACHE_DIRECTORY = os.environ.get('SHOPKEEPER_CACHE_DIRECTORY', os.path.join(ENGINE_DIRECTORY, '..', '.cache')) # shared between games, since blobs are content-addressed anyway
+CACHE_TTL = int(os.environ.get('SHOPKEEPER_CACHE_TTL', 7 * 24 * 60 * 60)) # seconds before a cached response gets revalidated
+DOWNLOAD_CONCURRENCY = int(os.environ.get('SHOPKEEPER_DOWNLOAD_CONCURRENCY', 8)) # how many images get downloaded at once
+CACHE_BYTE_BUDGET = int(os.environ.get('SHOPKEEPER_CACHE_BYTE_BUDGET', 512 * 1024 * 1024)) # least recently used entries get evicted past this
+CACHE_EVICTION_TARGET = 0.9 # the fraction of CACHE_BYTE_BUDGET eviction goes down to, so a full cache doesn't evict on every store
+CACHE_SAVE_INTERVAL = 64 # how many stores the cache index waits for before getting saved, besides at the end of every run
+CACHE_ORPHAN_AGE = 60 * 60 # seconds before a blob nothing in the index points to gets deleted anyway, since its process may just not have saved it yet
+MEMORY_BYTE_BUDGET = int(os.environ.get('SHOPKEEPER_MEMORY_BYTE_BUDGET', 1024 * 1024 * 1024)) # least recently used pages and images get forgotten past this
+MEMORY_LIMIT = int(os.environ.get('SHOPKEEPER_MEMORY_LIMIT', 0)) # bytes of data memory a rendering process gets before its render fails, or 0 for no limit
+LOW_MEMORY_STACK_SIZE = 1024 * 1024 # bytes of stack for each thread (like the render service's) started in low memory mode or under a memory limit, rather than the usual 8MB
+BUNDLE_FILEPATH = os.environ.get('SHOPKEEPER_BUNDLE') # an asset bundle made by the snapshot command, read before the cache or the network
+BUNDLE_MAGIC = b'SHOPKEEPER BUNDLE 1\n'
+BUNDLE_HEADER_FORMAT = '<QQ' # the offset and length of the json index, right after the magic
+
+# module state
+HTTP_SESSION = None # created by get_http_session on first use
+HTTP_TRANSPORT = None # swapped in by set_http_transport, otherwise a pooled adapter with retries
+HTTP_SESSION_LOCK = threading.Lock()
+DOWNLOAD_SLOTS = threading.BoundedSemaphore(max(DOWNLOAD_CONCURRENCY, 1)) # so batches running side by side still only make DOWNLOAD_CONCURRENCY requests at once
+CACHE_INDEX = None # loaded from CACHE_DIRECTORY on first use
+CACHE_CHANGES = {} # url -> cache entry for every store or use of one in CACHE_INDEX since it was last saved (see save_cache_index)
+CACHE_EVICTIONS = {} # url -> the cache entry that got evicted from under it, for every eviction since CACHE_INDEX was last saved
+CACHE_DROPPED_BLOBS = set() # blob hashes that some entry stopped pointing to since CACHE_INDEX was last saved, to delete once nothing does
+CACHE_BLOBS = {} # blob hash -> [size, how many entries in CACHE_INDEX point to it], kept up to date along with CACHE_INDEX
+CACHE_BYTES = 0 # the total size of the blobs in CACHE_BLOBS, which is what CACHE_BYTE_BUDGET applies to
+CACHE_UNSAVED_STORES = 0 # how many stores there have been since the cache index was last saved
+CACHE_WRITE_FAILED = False # set once writing to CACHE_DIRECTORY fails, so the warning about it only gets printed once
+CACHE_LOCK = threading.RLock() # guards CACHE_INDEX and CACHE_STATS, since downloads happen across several threads
+CACHE_STATS = { # how the cache got used, along with the network requests (and bytes) it couldn't avoid and the work done on what came back
+	'bundled': 0, 'hits': 0, 'misses': 0, 'revalidated': 0, 'stale': 0, 'evicted': 0,
+	'requests': 0, 'downloaded': 0, 'scanned': 0, 'decoded': 0
+}
+PROFILE_SPANS = None # the spans recorded by profile_span, once set_profiling turns it on
+OPEN_SPAN_STATS = contextvars.ContextVar('OPEN_SPAN_STATS', default = ()) # the stats of every profile span the running code is in (see count_stat)
+ASSET_BUNDLE = None # (memory map, url -> (offset, length)) for the bundle at BUNDLE_FILEPATH, opened on first use
+MEMORY_CACHE = collections.OrderedDict() # memo key -> (value, approximate bytes), least recently used first (see remember_memory)
+MEMORY_CACHE_BYTES = 0 # the total of the approximate bytes in MEMORY_CACHE
+MEMORY_LOCK = threading.Lock() # guards MEMORY_CACHE and MEMORY_CACHE_BYTES, since downloads and renders happen across several threads
+FONT_LOCK = threading.Lock() # freetype faces aren't safe to rasterize from several threads at once
+SERVICE_STATS = { 'started': None, 'renders': 0, 'failures': 0 } # for the render service's /stats, guarded by CACHE_LOCK
+LOW_MEMORY = os.environ.get('SHOPKEEPER_LOW_MEMORY', '').strip().lower() not in ('', '0', 'false', 'no', 'off') # whether images stay compressed until they get pasted, set by set_memory_mode
+MEMORY_LIMITED = False # whether set_memory_mode capped the data memory of this process, which its forked workers inherit
+GAME_PLUGINS = {} # plugin filepath -> plugin module, for every game loaded into this process (see load_game_plugin)
+
+
+# main: renders every build given in sys_argv (.json files, or globs and directories containing them) for game_plugin (the module
+# of a game's shopkeeper.py) in a single process, so the pages, images and fonts downloaded or loaded for one build are already warm for the next
+def main(sys_argv, game_plugin):
+	GAME_PLUGINS.setdefault(os.path.abspath(game_plugin.__file__), game_plugin) # so workers forked from here don't load it again
+	if sys_argv[1:2] == ['snapshot']:
+		sys.exit(snapshot_main(game_plugin, sys_argv[2:]))
+	if sys_argv[1:2] == ['serve']:
+		sys.exit(serve_main(game_plugin, sys_argv[2:]))
+	if sys_argv[1:2] == ['watch']:
+		sys.exit(watch_main(game_plugin, sys_argv[2:]))
+
+	argument_parser = argparse.ArgumentParser(description = 'Generates %s build images from data files.' % game_plugin.GAME)
+	argument_parser.add_argument('inputs', nargs = '*', help = '.json build files, or globs or directories containing them')
+	argument_parser.add_argument('-j', '--jobs', type = int, default = 1, help = 'how many worker processes to render the builds with')
+	argument_parser.add_argument('-b', '--bundle', help = 'an asset bundle made by the snapshot command to read pages and images from before going online')
+	argument_parser.add_argument('--profile', metavar = 'REPORT', help = 'where to write a json report of the time, requests, cache use and memory of every step')
+	argument_parser.add_argument('--cprofile', metavar = 'DUMP', help = 'where to write a cProfile dump of this process (so without --jobs, the renders themselves)')
+	add_memory_arguments(argument_parser)
+	add_output_arguments(argument_parser)
+	arguments = argument_parser.parse_args(sys_argv[1:])
+	if not arguments.inputs:
+		print('Error: no input file given.')
+		sys.exit(1)
+
+	input_filepaths = expand_input_paths(arguments.inputs)
+	if not input_filepaths:
+		print('Error: arguments must be .json files, or globs or directories containing them.')
+		sys.exit(1)
+
+	output_options = get_output_options(arguments)
+	if output_options['output'] and not os.path.isdir(output_options['output']) and len(input_filepaths) > 1:
+		print('Error: the output has to be a directory when rendering more than one build.')
+		sys.exit(1)
+	if any(not 0 < output_width <= MAXIMUM_OUTPUT_WIDTH for output_width in output_options['widths']):
+		print('Error: the widths have to be between 1 and %d.' % MAXIMUM_OUTPUT_WIDTH)
+		sys.exit(1)
+	if output_options['output'] and not os.path.isdir(output_options['output']) and len(set(output_options['widths'])) > 1:
+		print('Error: the output has to be a directory when rendering more than one width.')
+		sys.exit(1)
+	if output_options['output'] == '-':
+		output_options['output'] = sys.stdout.buffer
+		sys.stdout = sys.stderr # so none of the messages end up in the middle of the image
+
+	if arguments.bundle:
+		try:
+			open_asset_bundle(arguments.bundle)
+		except (IOError, OSError, ValueError) as bundle_error:
+			print('Error: could not open the asset bundle "%s": %s' % (arguments.bundle, bundle_error))
+			sys.exit(1)
+	try:
+		set_memory_mode(arguments.low_memory, arguments.memory_limit)
+	except ValueError as memory_error:
+		print('Error: could not limit the memory to %d bytes: %s' % (arguments.memory_limit, memory_error))
+		sys.exit(1)
+
+	set_profiling(bool(arguments.profile))
+	start_time = time.time()
+	function_profiler = cProfile.Profile() if arguments.cprofile else None
+	if function_profiler:
+		function_profiler.enable()
+	render_results = render_builds(game_plugin, input_filepaths, arguments.jobs, output_options)
+	if function_profiler:
+		function_profiler.disable()
+		function_profiler.dump_stats(arguments.cprofile)
+	if arguments.profile:
+		write_profile_report(arguments.profile, start_time, render_results)
+	save_cache_index() # hits only touch the access times in memory, so persist them for the next run's eviction order
+	print('Cache: %(hits)d hits, %(misses)d misses, %(revalidated)d revalidated, %(stale)d stale, %(evicted)d evicted, %(bundled)d bundled.' % CACHE_STATS)
+
+	failed_filepaths = [input_filepath for input_filepath, render_error in render_results if render_error]
+	if len(render_results) > 1:
+		print('Summary: rendered %d of %d builds.' % (len(render_results) - len(failed_filepaths), len(render_results)))
+		for input_filepath in failed_filepaths:
+			print('  Failed: "%s".' % input_filepath)
+	sys.exit(1 if failed_filepaths else 0)
+
+
+# add_memory_arguments: adds the arguments for low memory mode and the memory limit (see set_memory_mode) to argument_parser,
+# which default to the SHOPKEEPER_LOW_MEMORY and SHOPKEEPER_MEMORY_LIMIT environment variables
+def add_memory_arguments(argument_parser):
+	argument_parser.add_argument('--low-memory', action = 'store_true', default = LOW_MEMORY, help = 'keep images compressed until they get pasted, and decode oversize backgrounds at a reduced size')
+	argument_parser.add_argument('--memory-limit', metavar = 'BYTES', type = int, default = MEMORY_LIMIT, help = 'how much memory a rendering process can use before its render fails instead')
+
+
+# add_output_arguments: adds the arguments that pick how build images get encoded and where they go to argument_parser
+def add_output_arguments(argument_parser):
+	argument_parser.add_argument('-o', '--output', help = 'where to write the image (or images, if it\'s a directory) instead of next to each .json, with - for stdout')
+	argument_parser.add_argument('-f', '--format', choices = sorted(OUTPUT_FORMATS), default = 'png', help = 'the format to encode the images in')
+	argument_parser.add_argument('-q', '--quality', type = int, choices = OUTPUT_QUALITIES, metavar = '1-100', help = 'the jpeg or webp quality, from 1 to 100')
+	argument_parser.add_argument('--compress-level', type = int, choices = OUTPUT_COMPRESS_LEVELS, help = 'the png compression level, from 0 (fastest) to 9 (smallest)')
+	argument_parser.add_argument('--optimize', action = 'store_true', help = 'spend more time encoding for smaller images')
+	argument_parser.add_argument(
+		'-w', '--width', type = int, action = 'append', dest = 'widths',
+		help = 'a width in pixels to render each image at, which can be given more than once to get several sizes from a single drawing (any besides %d get it added to their filename)' % BUILD_IMAGE_DIMENSIONS[0]
+	)
+
+
+# get_output_options: collects the output arguments (see add_output_arguments) from the parsed arguments into the options for
+# render_build and encode_build_image
+def get_output_options(arguments):
+	return {
+		'output': arguments.output,
+		'widths': sorted(set(arguments.widths or [BUILD_IMAGE_DIMENSIONS[0]]), reverse = True),
+		'format': arguments.format,
+		'quality': arguments.quality,
+		'compress_level': arguments.compress_level,
+		'optimize': arguments.optimize
+	}
+
+
+# snapshot_main: packs every page the draw functions use for the builds given in snapshot_argv, along with every image on those pages,
+# along with any other urls game_plugin draws straight from (see get_build_urls), into a single asset bundle (see write_asset_bundle),
+# so that renders given that bundle never need the network; since whole pages get bundled, the bundle also covers other builds
+# for the same champions, as long as the wiki hasn't changed in the meantime; images that none of the builds use are left out
+# (and listed) if they can't be fetched, rather than failing the whole bundle
+def snapshot_main(game_plugin, snapshot_argv):
+	argument_parser = argparse.ArgumentParser(prog = 'shopkeeper.py snapshot', description = 'Packs the wiki pages and images that builds use into an asset bundle.')
+	argument_parser.add_argument('bundle', help = 'the asset bundle file to write')
+	argument_parser.add_argument('inputs', nargs = '+', help = '.json build files, or globs or directories containing them')
+	arguments = argument_parser.parse_args(snapshot_argv)
+	input_filepaths = expand_input_paths(arguments.inputs)
+	if not input_filepaths:
+		print('Error: arguments must be .json files, or globs or directories containing them.')
+		return 1
+
+	try:
+		snapshot_urls = set()
+		extra_urls = set()
+		snapshot_patches = set()
+		for input_filepath in input_filepaths:
+			build_data = load_build_data(input_filepath)
+			if build_data.get('Patch'):
+				snapshot_patches.add(build_data.get('Patch'))
+			needed_urls, other_urls = get_build_urls(game_plugin, build_data)
+			snapshot_urls.update(needed_urls)
+			extra_urls.update(other_urls)
+		bundle_entries, skipped_urls = write_asset_bundle(arguments.bundle, snapshot_urls, snapshot_patches, extra_urls)
+	except (IOError, OSError, ValueError, requests.RequestException) as snapshot_error:
+		print('Error: could not create the asset bundle "%s": %s' % (arguments.bundle, snapshot_error))
+		return 1
+	finally:
+		save_cache_index()
+
+	if skipped_urls:
+		print('Warning: left out %d images that none of the builds use, since they could not be fetched:' % len(skipped_urls))
+		for skipped_url in sorted(skipped_urls):
+			print('  %s: %s' % (skipped_url, skipped_urls[skipped_url]))
+	print('Success: bundled %d pages and images for %s into "%s".' % (len(bundle_entries), ', '.join(sorted(snapshot_patches)) or 'no patch', arguments.bundle))
+	return 0
+
+
+# watch_main: renders the builds given in watch_argv, then keeps polling them and rerenders each one whenever it changes;
+# every draw stage's layer is kept per build, so an edit only redraws the stages whose inputs it touched
+# (see draw_stage_layer) before compositing them all again; new files that match the arguments get picked up too
+def watch_main(game_plugin, watch_argv):
+	argument_parser = argparse.ArgumentParser(prog = 'shopkeeper.py watch', description = 'Rerenders builds whenever their data files change.')
+	argument_parser.add_argument('inputs', nargs = '+', help = '.json build files, or globs or directories containing them')
+	argument_parser.add_argument('-i', '--interval', type = float, default = 0.5, help = 'how many seconds to wait between checking the files for changes')
+	argument_parser.add_argument('-b', '--bundle', help = 'an asset bundle made by the snapshot command to read pages and images from before going online')
+	add_memory_arguments(argument_parser)
+	add_output_arguments(argument_parser)
+	arguments = argument_parser.parse_args(watch_argv)
+	output_options = get_output_options(arguments)
+	if output_options['output'] and not os.path.isdir(output_options['output']):
+		print('Error: the output has to be a directory when watching builds.')
+		return 1
+	if output_options['widths'] != [BUILD_IMAGE_DIMENSIONS[0]]:
+		print('Error: watch mode only renders at the full width of %d.' % BUILD_IMAGE_DIMENSIONS[0])
+		return 1
+	if arguments.bundle:
+		try:
+			open_asset_bundle(arguments.bundle)
+		except (IOError, OSError, ValueError) as bundle_error:
+			print('Error: could not open the asset bundle "%s": %s' % (arguments.bundle, bundle_error))
+			return 1
+	try:
+		set_memory_mode(arguments.low_memory, arguments.memory_limit)
+	except ValueError as memory_error:
+		print('Error: could not limit the memory to %d bytes: %s' % (arguments.memory_limit, memory_error))
+		return 1
+
+	watched_builds = {} # input filepath -> (modification time, stage name -> (stage inputs, stage layer))
+	print('Watching: %s (press Ctrl+C to stop).' % ', '.join(arguments.inputs))
+	try:
+		while True:
+			input_filepaths = expand_input_paths(arguments.inputs)
+			for input_filepath in list(watched_builds):
+				if input_filepath not in input_filepaths:
+					del watched_builds[input_filepath]
+			for input_filepath in input_filepaths:
+				try:
+					modification_time = os.stat(input_filepath).st_mtime
+				except OSError:
+					watched_builds.pop(input_filepath, None) # it's gone, so start over if it ever comes back
+					continue
+				if input_filepath in watched_builds and watched_builds[input_filepath][0] == modification_time:
+					continue
+				stage_layers = watched_builds.get(input_filepath, (None, {}))[1]
+				watched_builds[input_filepath] = (modification_time, stage_layers) # even if it fails, so it only gets retried once it changes again
+				rerender_watched_build(game_plugin, input_filepath, stage_layers, output_options)
+			time.sleep(arguments.interval)
+	except KeyboardInterrupt:
+		pass
+	finally:
+		save_cache_index()
+	return 0
+
+
+# rerender_watched_build: renders the build at input_filepath for watch mode (with game_plugin and the given output_options), reusing
+# whichever of its stage_layers are still up to date, and prints which stages had to be redrawn and how long it all took
+def rerender_watched_build(game_plugin, input_filepath, stage_layers, output_options = None):
+	output_filepath = get_output_filepath(input_filepath, output_options)
+	start_time = time.time()
+	previous_layers = dict(stage_layers)
+	try:
+		build_image = draw_build(game_plugin, load_build_data(input_filepath), False, stage_layers)
+		write_build_image(build_image, output_filepath, output_options)
+	except Exception as render_error:
+		stage_layers.clear() # it could have been left halfway through a stage
+		print('Error: could not create a build image from "%s": %s' % (input_filepath, describe_error(render_error)))
+		return
+	redrawn_stages = [stage_name for stage_name in game_plugin.STAGE_LOOKUPS if previous_layers.get(stage_name) is not stage_layers.get(stage_name)]
+	print('Updated: "%s" from "%s" in %.2fs, redrawing %s.' % (output_filepath, input_filepath, time.time() - start_time, ', '.join(redrawn_stages) or 'nothing'))
+
+
+# serve_main: runs a local http service that renders builds on demand, keeping the pages, images, fonts and layers it has loaded
+# warm in memory (up to MEMORY_BYTE_BUDGET) from one request to the next, so each render only costs the compositing;
+# POST /render takes a build's json as its body and answers with the png (or another format, with query parameters for
+# the encode_build_image options like ?format=webp&quality=80, or ?width=480 for a smaller image), GET /health answers once the service is up,
+# and GET /stats reports how the caches are doing; every request gets its own thread, so renders can overlap
+def serve_main(game_plugin, serve_argv):
+	argument_parser = argparse.ArgumentParser(prog = 'shopkeeper.py serve', description = 'Runs a local http service that renders builds on demand.')
+	argument_parser.add_argument('--host', default = '127.0.0.1', help = 'the address to listen on')
+	argument_parser.add_argument('--port', type = int, default = 8000, help = 'the port to listen on')
+	argument_parser.add_argument('-b', '--bundle', help = 'an asset bundle made by the snapshot command to read pages and images from before going online')
+	add_memory_arguments(argument_parser)
+	arguments = argument_parser.parse_args(serve_argv)
+	try:
+		if arguments.bundle:
+			open_asset_bundle(arguments.bundle)
+		set_memory_mode(arguments.low_memory, arguments.memory_limit)
+		render_server = ThreadingHTTPServer((arguments.host, arguments.port), RenderRequestHandler)
+		render_server.game_plugin = game_plugin
+	except (IOError, OSError, ValueError) as serve_error:
+		print('Error: could not start the render service: %s' % serve_error)
+		return 1
+
+	SERVICE_STATS['started'] = time.time()
+	print('Serving: rendering builds at "http://%s:%d/render".' % (arguments.host, arguments.port))
+	try:
+		render_server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		render_server.server_close()
+		save_cache_index()
+	return 0
+
+
+# RenderRequestHandler: hands each request to the render service over to get_service_response with the server's game plugin,
+# and sends back what it gives
+class RenderRequestHandler(BaseHTTPRequestHandler):
+	def do_GET(self):
+		self.send_service_response(*get_service_response(self.server.game_plugin, 'GET', self.path, b''))
+
+	def do_POST(self):
+		request_body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+		self.send_service_response(*get_service_response(self.server.game_plugin, 'POST', self.path, request_body))
+
+	def send_service_response(self, status_code, content_type, response_body):
+		self.send_response(status_code)
+		self.send_header('Content-Type', content_type)
+		self.send_header('Content-Length', str(len(response_body)))
+		self.end_headers()
+		self.wfile.write(response_body)
+
+
+# get_service_response: answers a request to the render service (see serve_main) of game_plugin for path with the given method and body,
+# giving back the (status code, content type, body) to respond with
+def get_service_response(game_plugin, request_method, request_path, request_body):
+	request_path, _, request_query = request_path.partition('?')
+	if request_method == 'GET' and request_path == '/health':
+		return 200, 'application/json', json.dumps({ 'status': 'ok' }).encode('utf-8')
+	if request_method == 'GET' and request_path == '/stats':
+		with CACHE_LOCK, MEMORY_LOCK:
+			service_stats = {
+				'uptime': time.time() - (SERVICE_STATS['started'] or time.time()),
+				'renders': SERVICE_STATS['renders'],
+				'failures': SERVICE_STATS['failures'],
+				'cache': dict(CACHE_STATS),
+				'memory': { 'entries': len(MEMORY_CACHE), 'bytes': MEMORY_CACHE_BYTES, 'budget': MEMORY_BYTE_BUDGET },
+				'text_sprites': len([memo_key for memo_key in MEMORY_CACHE if memo_key[0] == 'Sprite'])
+			}
+		return 200, 'application/json', json.dumps(service_stats).encode('utf-8')
+	if request_path != '/render':
+		return 404, 'text/plain', b'Error: no such endpoint.'
+	if request_method != 'POST':
+		return 405, 'text/plain', b'Error: builds have to be POSTed.'
+
+	try:
+		build_data = json.loads(request_body.decode('utf-8'))
+		if not isinstance(build_data, dict):
+			raise ValueError('the build data has to be a json object')
+	except ValueError as parse_error:
+		return 400, 'text/plain', ('Error: could not read the build data: %s' % parse_error).encode('utf-8')
+	try:
+		request_parameters = dict((parameter_name, values[-1]) for parameter_name, values in urllib.parse.parse_qs(request_query).items())
+		output_options = {
+			'format': request_parameters.get('format', 'png'),
+			'quality': int(request_parameters['quality']) if 'quality' in request_parameters else None,
+			'compress_level': int(request_parameters['compress_level']) if 'compress_level' in request_parameters else None,
+			'optimize': request_parameters.get('optimize') in ('1', 'true')
+		}
+		if output_options['format'] not in OUTPUT_FORMATS:
+			raise ValueError('the format has to be one of %s' % ', '.join(sorted(OUTPUT_FORMATS)))
+		if output_options['quality'] is not None and output_options['quality'] not in OUTPUT_QUALITIES:
+			raise ValueError('the quality has to be between 1 and 100')
+		if output_options['compress_level'] is not None and output_options['compress_level'] not in OUTPUT_COMPRESS_LEVELS:
+			raise ValueError('the compress level has to be between 0 and 9')
+		output_width = int(request_parameters.get('width', BUILD_IMAGE_DIMENSIONS[0]))
+		if not 0 < output_width <= MAXIMUM_OUTPUT_WIDTH:
+			raise ValueError('the width has to be between 1 and %d' % MAXIMUM_OUTPUT_WIDTH)
+	except ValueError as parameter_error:
+		return 400, 'text/plain', ('Error: bad output options: %s' % parameter_error).encode('utf-8')
+	try:
+		display_list, build_layers, stage_inputs = draw_build_layers(game_plugin, build_data, [] if LOW_MEMORY else [float(output_width) / BUILD_IMAGE_DIMENSIONS[0]])
+		build_image = rasterize_build(display_list, build_layers, output_width)
+		image_bytes = encode_build_image(build_image, output_options)
+	except Exception as render_error:
+		with CACHE_LOCK:
+			SERVICE_STATS['failures'] += 1
+		return 500, 'text/plain', ('Error: could not create a build image: %s' % describe_error(render_error)).encode('utf-8')
+	with CACHE_LOCK:
+		SERVICE_STATS['renders'] += 1
+	return 200, OUTPUT_FORMATS[output_options['format']][2], image_bytes
+
+
+# expand_input_paths: turns each of the given arguments into the .json files it refers to, keeping their order and dropping duplicates
+def expand_input_paths(input_arguments):
+	input_filepaths = []
+	for input_argument in input_arguments:
+		if os.path.isdir(input_argument):
+			matched_filepaths = sorted(glob.glob(os.path.join(input_argument, '*.json')))
+		else:
+			matched_filepaths = sorted(glob.glob(input_argument)) or [input_argument]
+		for matched_filepath in matched_filepaths:
+			if matched_filepath.endswith('.json') and matched_filepath not in input_filepaths:
+				input_filepaths.append(matched_filepath)
+	return input_filepaths
+
+
+# render_builds: renders each of the input_filepaths, returning a list of (input filepath, error message or None) pairs in the same order
+# instead of stopping at the first failure, since one malformed build shouldn't keep the rest of the library from rendering;
+# with more than one job, every image the builds need is downloaded into the on-disk cache up front, and then the builds
+# get split across worker processes that render straight out of that cache without scraping anything again;
+# output_options (see encode_build_image and get_output_filepath) pick how and where the images get written, and game_plugin draws them
+def render_builds(game_plugin, input_filepaths, jobs = 1, output_options = None):
+	render_results = []
+	if jobs > 1 and len(input_filepaths) > 1:
+		with profile_span('prefetch', '%d builds' % len(input_filepaths)):
+			prefetch_builds(game_plugin, input_filepaths)
+		save_cache_index() # workers that don't fork from this process need to find everything on disk
+		worker_pool = multiprocessing.Pool(min(jobs, len(input_filepaths)), initialize_worker, (BUNDLE_FILEPATH, PROFILE_SPANS is not None, LOW_MEMORY))
+		plugin_filepath = os.path.abspath(game_plugin.__file__) # modules can't be pickled, so workers load the plugin by path (see load_game_plugin)
+		try:
+			worker_results = worker_pool.map(render_build_in_worker, [(plugin_filepath, input_filepath, output_options) for input_filepath in input_filepaths], 1)
+		finally:
+			worker_pool.close()
+			worker_pool.join()
+		for input_filepath, render_error, worker_cache_stats, worker_spans in worker_results:
+			for stat_name, stat_count in worker_cache_stats.items():
+				count_stat(stat_name, stat_count)
+			if PROFILE_SPANS is not None:
+				PROFILE_SPANS.extend(worker_spans)
+			render_results.append((input_filepath, render_error))
+		return render_results
+
+	for input_filepath in input_filepaths:
+		try:
+			render_build(game_plugin, input_filepath, output_options)
+			render_results.append((input_filepath, None))
+		except Exception as render_error:
+			print('Error: could not create a build image from "%s": %s' % (input_filepath, describe_error(render_error)))
+			render_results.append((input_filepath, describe_error(render_error)))
+	save_cache_index() # the index only gets saved every CACHE_SAVE_INTERVAL stores along the way
+	return render_results
+
+
+# initialize_worker: sets up a freshly started worker process, which needs its own connections, its own map of the asset bundle
+# at bundle_filepath if it wasn't forked from a process that already had it open, its own spans if profiling, and low_memory
+# passed along (the memory limit itself gets inherited)
+def initialize_worker(bundle_filepath, profiling, low_memory):
+	reset_http_session()
+	set_profiling(profiling)
+	set_memory_mode(low_memory)
+	if bundle_filepath and ASSET_BUNDLE is None:
+		open_asset_bundle(bundle_filepath)
+
+
+# load_game_plugin: gives the plugin module of the game whose shopkeeper.py is at plugin_filepath, only loading each one once per process
+# (under its own name, since every game's script is called shopkeeper.py), so several games can render side by side with the same caches
+def load_game_plugin(plugin_filepath):
+	plugin_filepath = os.path.abspath(plugin_filepath)
+	if plugin_filepath not in GAME_PLUGINS:
+		plugin_spec = importlib.util.spec_from_file_location('shopkeeper_' + os.path.basename(os.path.dirname(plugin_filepath)), plugin_filepath)
+		game_plugin = importlib.util.module_from_spec(plugin_spec)
+		plugin_spec.loader.exec_module(game_plugin)
+		GAME_PLUGINS[plugin_filepath] = game_plugin
+	return GAME_PLUGINS[plugin_filepath]
+
+
+# render_build_in_worker: renders a single build inside a worker process with the game plugin at the filepath it's given,
+# also passing back how it used the cache and any profile spans
+def render_build_in_worker(render_arguments):
+	plugin_filepath, input_filepath, output_options = render_arguments
+	initial_cache_stats = dict(CACHE_STATS)
+	initial_span_count = len(PROFILE_SPANS or [])
+	(input_filepath, render_error), = render_builds(load_game_plugin(plugin_filepath), [input_filepath], 1, output_options)
+	worker_cache_stats = dict((stat_name, CACHE_STATS[stat_name] - initial_cache_stats[stat_name]) for stat_name in CACHE_STATS)
+	return input_filepath, render_error, worker_cache_stats, (PROFILE_SPANS or [])[initial_span_count:]
+
+
+# prefetch_builds: downloads the union of every image the builds at input_filepaths need (as drawn by game_plugin) into the on-disk cache,
+# merging lookups that are shared between builds so each page gets scanned and each image gets downloaded only once
+def prefetch_builds(game_plugin, input_filepaths):
+	merged_lookups = {}
+	asset_urls = set()
+	for input_filepath in input_filepaths:
+		try:
+			build_data = load_build_data(input_filepath)
+		except (IOError, OSError, ValueError):
+			continue # the render will report this one properly
+		asset_urls.update(game_plugin.get_asset_urls(build_data))
+		for image_lookup in game_plugin.get_image_lookups(build_data).values():
+			wiki_page, page_extractor, reverse_order, link_modifiers, wanted_keys, icon_operations, wiki_patch = image_lookup # the icon operations don't matter here
+			lookup_key = (wiki_page, page_extractor, reverse_order, tuple(sorted((link_modifiers or {}).items())), wiki_patch)
+			merged_lookups.setdefault(lookup_key, set()).update(wanted_keys)
+
+	for (wiki_page, page_extractor, reverse_order, link_modifiers, wiki_patch), wanted_keys in merged_lookups.items():
+		try:
+			image_links = get_image_links(game_plugin.PAGE_EXTRACTORS, wiki_page, page_extractor, reverse_order, dict(link_modifiers), wiki_patch)
+			map_concurrently(fetch_url, [image_links[image_key] for image_key in wanted_keys if image_key in image_links])
+		except requests.RequestException as fetch_error:
+			print('Warning: could not prefetch from "%s": %s' % (wiki_page, fetch_error))
+	for asset_url in sorted(asset_urls):
+		try:
+			fetch_url(asset_url)
+		except requests.RequestException as fetch_error:
+			print('Warning: could not prefetch "%s": %s' % (asset_url, fetch_error))
+
+
+# write_profile_report: writes what profiling recorded since start_time to report_filepath as json, with the totals for the run
+# (everything in CACHE_STATS, plus the peak memory of this process or any worker) and every span, in the order they started:
+# each build, draw stage and get_images call, the png encodes and any prefetching, all with the stats of what happened during them
+def write_profile_report(report_filepath, start_time, render_results):
+	profile_spans = sorted(PROFILE_SPANS, key = lambda span: span['start'])
+	profile_report = {
+		'started': start_time,
+		'duration': time.time() - start_time,
+		'builds': len(render_results),
+		'failed': len([render_error for input_filepath, render_error in render_results if render_error]),
+		'stats': dict(CACHE_STATS),
+		'peak_memory': max([span['peak_memory'] for span in profile_spans] + [get_peak_memory()]) if resource else None,
+		'spans': profile_spans
+	}
+	try:
+		with open(report_filepath, 'w') as report_filehandle:
+			json.dump(profile_report, report_filehandle, indent = '\t')
+	except (IOError, OSError) as report_error:
+		print('Warning: could not write the profile report "%s": %s' % (report_filepath, report_error))
+
+
+# load_build_data: reads the build data out of the .json at input_filepath
+def load_build_data(input_filepath):
+	with open(input_filepath) as input_filehandle:
+		return json.load(input_filehandle)
+
+
+# render_build: loads the data at input_filepath and draws its build image at each of the widths in output_options, writing them
+# wherever output_options say (see get_output_filepath); the draw stages only run once, preparing their layers for every size
+# while the others are still downloading (see draw_build_layers), apart from in low memory mode, where every size gets rasterized
+# from their display list one operation at a time instead; game_plugin does the drawing
+def render_build(game_plugin, input_filepath, output_options = None):
+	output_options = output_options or {}
+	output_widths = output_options.get('widths') or [BUILD_IMAGE_DIMENSIONS[0]]
+	output_filepaths = []
+	with profile_span('build', input_filepath):
+		build_data = load_build_data(input_filepath)
+		output_scales = [] if LOW_MEMORY else [float(output_width) / BUILD_IMAGE_DIMENSIONS[0] for output_width in output_widths]
+		display_list, build_layers, stage_inputs = draw_build_layers(game_plugin, build_data, output_scales, True)
+		for output_width in output_widths:
+			output_filepath = get_output_filepath(input_filepath, output_options, output_width)
+			with profile_span('rasterize', str(output_width)):
+				build_image = rasterize_build(display_list, build_layers, output_width)
+			write_build_image(build_image, output_filepath, output_options)
+			output_filepaths.append(output_filepath)
+	for output_filepath in output_filepaths:
+		print('Success: created "%s" from "%s".' % (getattr(output_filepath, 'name', output_filepath), input_filepath))
+	return output_filepaths
+
+
+# get_output_filepath: gives where the image for the build at input_filepath goes according to output_options: by default, in the
+# same location as the input json, just with the extension of the output format; or in the output directory under that name,
+# or at the output path itself, which can also be a binary file object (like stdout, or an in-memory buffer); images at any
+# output_width other than the layout's get it added to their name, so they can sit next to the full size one
+def get_output_filepath(input_filepath, output_options = None, output_width = None):
+	output_options = output_options or {}
+	output_extension = OUTPUT_FORMATS[output_options.get('format') or 'png'][1]
+	if output_width and output_width != BUILD_IMAGE_DIMENSIONS[0]:
+		output_extension = '-%d%s' % (output_width, output_extension)
+	output_filepath = re.sub(r'\.json$', output_extension, input_filepath)
+	output_path = output_options.get('output')
+	if not output_path:
+		return output_filepath
+	if not hasattr(output_path, 'write') and os.path.isdir(output_path):
+		return os.path.join(output_path, os.path.basename(output_filepath))
+	return output_path
+
+
+# write_build_image: encodes build_image with output_options (see encode_build_image) and writes it to output_filepath,
+# which can also be a binary file object
+def write_build_image(build_image, output_filepath, output_options = None):
+	with profile_span('encode', getattr(output_filepath, 'name', output_filepath)):
+		image_bytes = encode_build_image(build_image, output_options)
+	if hasattr(output_filepath, 'write'):
+		output_filepath.write(image_bytes)
+		output_filepath.flush()
+	else:
+		with open(output_filepath, 'wb') as output_filehandle:
+			output_filehandle.write(image_bytes)
+
+
+# encode_build_image: encodes build_image in the format given in output_options (one of OUTPUT_FORMATS) and gives back the bytes;
+# quality is for jpeg and webp, compress_level for png, and optimize trades encode time for size in all three, while anything
+# left out gets the encoder's own default, so no options at all gets the same png the script has always written
+def encode_build_image(build_image, output_options = None):
+	output_options = output_options or {}
+	output_format = output_options.get('format') or 'png'
+	encoder_options = {}
+	if output_options.get('quality') is not None and output_format != 'png':
+		encoder_options['quality'] = output_options['quality']
+	if output_options.get('compress_level') is not None and output_format == 'png':
+		encoder_options['compress_level'] = output_options['compress_level']
+	if output_options.get('optimize'):
+		if output_format == 'webp':
+			encoder_options['method'] = 6 # webp's slowest and smallest
+		else:
+			encoder_options['optimize'] = True
+	image_buffer = io.BytesIO()
+	build_image.save(image_buffer, OUTPUT_FORMATS[output_format][0], **encoder_options)
+	return image_buffer.getvalue()
+
+
+# draw_build: draws the final image for build_data with game_plugin at full size, printing each step if print_steps is given; given stage_layers
+# (see draw_stage_layer), the stages get rasterized as separate layers that are kept there to be reused next time
+def draw_build(game_plugin, build_data, print_steps = False, stage_layers = None):
+	display_list, build_layers, stage_inputs = draw_build_layers(game_plugin, build_data, (), print_steps)
+	if stage_layers is None:
+		return rasterize_display_list(display_list)
+
+	# the base image is pure black, then we draw each layer on top of it; everything is drawn over the background, so its inputs are inputs of every stage
+	build_image = Image.new('RGB', BUILD_IMAGE_DIMENSIONS, (0, 0, 0))
+	for stage_name, draw_operations in display_list:
+		build_image = draw_stage_layer(build_image, stage_name, draw_operations, stage_inputs['draw_background'] + stage_inputs[stage_name], stage_layers)
+	return build_image
+
+
+# draw_build_layers: starts every draw stage of game_plugin (the draw functions named in its STAGE_LOOKUPS, in drawing order) for
+# build_data at once, each on its own thread (see draw_stage), so that each one resolves its images, runs its draw function and prepares
+# its layer at every one of scales (see prepare_layer) as soon as its own images arrive, rather than waiting on every page in turn;
+# one stage's decoding and resampling then overlaps another's downloads, and a render takes about as long as its slowest stage
+# instead of all of them added up; gives back the display list (everything the stages draw, as (stage name, draw operations) pairs)
+# along with the layers for each scale (scale -> layers), both in the original drawing order whichever stage finished first,
+# so compositing them (see composite_layers) comes out exactly like rasterizing the display list, and the inputs of each stage
+# (stage name -> stage inputs, see draw_stage); prints each step, and any names that didn't turn up on the wiki, if print_steps is given
+def draw_build_layers(game_plugin, build_data, scales = (), print_steps = False):
+	stage_names = list(game_plugin.STAGE_LOOKUPS)
+	stage_results = {}
+	stage_inputs = {}
+	unresolved_assets = {}
+	stage_arguments = [(game_plugin, stage_name, build_data, scales) for stage_name in stage_names]
+	stage_pool = ThreadPool(len(stage_names)) if get_thread_count(len(stage_names)) > 1 else None
+	try:
+		for stage_name, draw_operations, stage_layers, stage_unresolved, stage_inputs[stage_name] in (
+			stage_pool.imap_unordered(get_context_function(draw_stage), stage_arguments) if stage_pool else map(draw_stage, stage_arguments)
+		):
+			stage_results[stage_name] = (draw_operations, stage_layers)
+			unresolved_assets.update(stage_unresolved)
+			if print_steps:
+				print("Finished step: " + stage_name)
+	finally:
+		if stage_pool:
+			stage_pool.close()
+			stage_pool.join()
+	if print_steps and unresolved_assets:
+		print('Warning: could not find the images for %s.' % describe_unresolved_assets(unresolved_assets))
+
+	display_list = [(stage_name, stage_results[stage_name][0]) for stage_name in stage_names]
+	build_layers = dict((scale, [stage_results[stage_name][1][i] for stage_name in stage_names]) for i, scale in enumerate(scales))
+	return display_list, build_layers, stage_inputs
+
+
+# draw_stage: runs a single draw stage for draw_build_layers, given the (game plugin, stage name, build data, scales) in stage_arguments;
+# resolves only the images in the plugin's STAGE_LOOKUPS for it, hands them to the plugin's draw function of that name, and gives back
+# its (stage name, draw operations, layer for each of the scales, unresolved assets, stage inputs); the stage inputs are everything
+# its drawing depends on as a string, which is the build data under every key the draw function actually read (see RecordingBuildData)
+# along with its image lookups, which cover whatever the images depend on (like the patch), so watch mode knows which stages an edit touches
+def draw_stage(stage_arguments):
+	game_plugin, stage_name, build_data, scales = stage_arguments
+	with profile_span('stage', stage_name):
+		build_assets, unresolved_assets = resolve_build_assets(game_plugin, build_data, game_plugin.STAGE_LOOKUPS[stage_name])
+		recording_data = RecordingBuildData(build_data)
+		draw_operations = getattr(game_plugin, stage_name)([], recording_data, build_assets)
+		stage_layers = [prepare_layer(draw_operations, scale) for scale in scales]
+	image_lookups = game_plugin.get_image_lookups(build_data)
+	stage_inputs = json.dumps([
+		[(input_key, build_data.get(input_key)) for input_key in sorted(recording_data.read_keys)],
+		[image_lookups.get(lookup_name) for lookup_name in game_plugin.STAGE_LOOKUPS[stage_name]]
+	], sort_keys = True, default = sorted) # the wanted keys of a lookup are a set
+	return stage_name, draw_operations, stage_layers, unresolved_assets, stage_inputs
+
+
+# RecordingBuildData: a copy of the build data that draw functions get in place of it, noting down every key they read from it in
+# read_keys, so the keys each stage depends on come from what it actually does rather than from a list that could fall out of date
+class RecordingBuildData(dict):
+	def __init__(self, build_data):
+		dict.__init__(self, build_data)
+		self.read_keys = set()
+
+	def __getitem__(self, key):
+		self.read_keys.add(key)
+		return dict.__getitem__(self, key)
+
+	def get(self, key, default = None):
+		self.read_keys.add(key)
+		return dict.get(self, key, default)
+
+	def __contains__(self, key):
+		self.read_keys.add(key)
+		return dict.__contains__(self, key)
+
+	def __iter__(self):
+		self.read_keys.update(dict.keys(self)) # anything that goes through every key depends on all of them
+		return dict.__iter__(self)
+
+	def keys(self):
+		self.read_keys.update(dict.keys(self))
+		return dict.keys(self)
+
+	def values(self):
+		self.read_keys.update(dict.keys(self))
+		return dict.values(self)
+
+	def items(self):
+		self.read_keys.update(dict.keys(self))
+		return dict.items(self)
+
+
+# rasterize_build: gives the image for output_width, compositing the layers draw_build_layers already prepared for its scale
+# in build_layers if there are any, or else rasterizing display_list at that scale
+def rasterize_build(display_list, build_layers, output_width):
+	scale = float(output_width) / BUILD_IMAGE_DIMENSIONS[0]
+	if scale in build_layers:
+		return composite_layers(build_layers[scale], scale)
+	return rasterize_display_list(display_list, scale)
+
+
+# rasterize_display_list: replays every draw operation in display_list (see draw_build_layers) onto build_image, or onto a new black
+# image scale times the size of the layout; every position and size in the operations is in layout units (the pixels of a
+# BUILD_IMAGE_DIMENSIONS image), and gets scaled to match, so scale 1 comes out exactly like drawing straight onto the build image;
+# each operation gets pasted as soon as it's prepared (see prepare_operation), so only one image is ever decoded at a time in low
+# memory mode; the operations are:
+#   ('background', skin key, get_source)           the dimmed skin image from get_source filling the image, cached under skin key
+#   ('image', image, position, masked)             image pasted with its top left corner at position, through its own alpha if masked
+#                                                  (or if it has any, when masked is None); the image can still be compressed (see decode_image)
+#   ('anchored_text', text, anchor, offset, size)  text offset from the (horizontal, vertical) anchor corner of the image
+#   ('centered_text', text, rectangle, size)       text centered in the rectangle
+#   ('template', template key, operations)         a static layer of these operations and rectangles (see get_template_layer)
+def rasterize_display_list(display_list, scale = 1, build_image = None):
+	if build_image is None:
+		build_image = Image.new('RGB', scale_size(BUILD_IMAGE_DIMENSIONS, scale), (0, 0, 0))
+	for stage_name, draw_operations in display_list:
+		for draw_operation in draw_operations:
+			build_image = paste_layer(build_image, prepare_operation(draw_operation, scale))
+	return build_image
+
+
+# composite_layers: pastes each of the prepared stage_layers (see prepare_layer) in order onto a new black image at scale
+def composite_layers(stage_layers, scale = 1):
+	build_image = Image.new('RGB', scale_size(BUILD_IMAGE_DIMENSIONS, scale), (0, 0, 0))
+	for stage_layer in stage_layers:
+		build_image = paste_layer(build_image, stage_layer)
+	return build_image
+
+
+# paste_layer: makes each (source, position, mask) paste in stage_layer on build_image in order, where the source is an image or a color
+def paste_layer(build_image, stage_layer):
+	for paste_source, paste_position, paste_mask in stage_layer:
+		build_image.paste(paste_source, paste_position, paste_mask)
+	return build_image
+
+
+# prepare_layer: prepares every one of draw_operations at scale (see prepare_operation), giving back the layer they make
+# as a single list of pastes, which draw just like rasterizing them would when pasted in order (see paste_layer)
+def prepare_layer(draw_operations, scale = 1):
+	return [operation_paste for draw_operation in draw_operations for operation_paste in prepare_operation(draw_operation, scale)]
+
+
+# prepare_operation: does all the work of drawing the single draw_operation (see rasterize_display_list) at scale apart from
+# the pasting itself, giving back the list of (source, position, mask) pastes that draw it; images get decoded and resampled
+# to their scaled size, text gets rasterized again at its scaled font size, and the background and templates come out of their caches
+def prepare_operation(draw_operation, scale):
+	image_size = scale_size(BUILD_IMAGE_DIMENSIONS, scale)
+	operation_name = draw_operation[0]
+	if operation_name == 'background':
+		skin_key, get_source = draw_operation[1:]
+		background_layer = get_cached_layer(
+			('Background',) + skin_key + (image_size, BACKGROUND_ALPHA) + (('Reduced',) if LOW_MEMORY else ()), # see decode_image
+			lambda: decode_image(get_source(), image_size[0]),
+			lambda skin_image: make_background_layer(skin_image, image_size)
+		)
+		return [(background_layer, (0, 0), None)] if background_layer else [] # the layer was composited onto the same black we start with
+	elif operation_name == 'image':
+		image, image_position, masked = draw_operation[1:]
+		image = decode_image(image) # in low memory mode, this is the only time it's decoded, and it's let go again once it's pasted
+		if masked is None:
+			masked = 'A' in image.mode
+		if image is not None and scale != 1:
+			image = image.resize(scale_size(image.size, scale), Image.LANCZOS)
+		return [(image, scale_point(image_position, scale), image if masked else None)]
+	elif operation_name == 'anchored_text':
+		draw_text, text_anchor, text_offset, font_size = draw_operation[1:]
+		font_size = scale_size((font_size,), scale)[0]
+		text_offset = scale_point(text_offset, scale)
+		text_width, text_height = get_text_sprite(draw_text, font_size)[1]
+		text_position = (
+			0 + text_offset[0] if text_anchor[0] == 'left' else image_size[0] - (text_offset[0] + text_width ),
+			0 + text_offset[1] if text_anchor[1] == 'top'  else image_size[1] - (text_offset[1] + text_height)
+		)
+		return [get_text_paste(text_position, draw_text, font_size)]
+	elif operation_name == 'centered_text':
+		draw_text, outline_rectangle, font_size = draw_operation[1:]
+		font_size = scale_size((font_size,), scale)[0]
+		text_position = get_centered_position(
+			scale_rectangle(outline_rectangle, scale), get_text_sprite(draw_text, font_size)[1], scale_point((FONT_HEIGHT_BONUS,), scale)[0]
+		)
+		return [get_text_paste(text_position, draw_text, font_size)]
+	elif operation_name == 'template':
+		template_key, template_operations = draw_operation[1:]
+		template_layer = get_template_layer(template_key, template_operations, scale)
+		return [(template_layer[0], template_layer[2], template_layer[1])] if template_layer else []
+	else:
+		raise ValueError('unknown draw operation "%s"' % operation_name)
+
+
+# scale_point: scales the coordinates of point from layout units to the pixels of an image at scale
+def scale_point(point, scale):
+	return tuple(int(round(coordinate * scale)) for coordinate in point)
+
+
+# scale_size: like scale_point, but for sizes, which never go below a single pixel
+def scale_size(size, scale):
+	return tuple(max(1, length) for length in scale_point(size, scale))
+
+
+# scale_rectangle: scales both corners of the ((left, top), (right, bottom)) rectangle like scale_point does
+def scale_rectangle(rectangle, scale):
+	return tuple(scale_point(corner, scale) for corner in rectangle)
+
+
+# draw_stage_layer: composites the layer for stage_name (whose display list is draw_operations) onto build_image, only rasterizing it
+# again if its stage_inputs (see draw_stage) changed since the layer in stage_layers (stage name -> (stage inputs, stage layer))
+# was rasterized; the background layer is the whole image, and every other stage's layer is just the pixels it changes when drawn over
+# the background alone, which composites to the same image as drawing them all in order because each stage draws in its own part of the image
+def draw_stage_layer(build_image, stage_name, draw_operations, stage_inputs, stage_layers):
+	if stage_name not in stage_layers or stage_layers[stage_name][0] != stage_inputs:
+		if stage_name == 'draw_background':
+			stage_layer = rasterize_display_list([(stage_name, draw_operations)], 1, build_image.copy())
+		else:
+			background_layer = stage_layers['draw_background'][1]
+			stage_layer = get_layer_difference(rasterize_display_list([(stage_name, draw_operations)], 1, background_layer.copy()), background_layer)
+		stage_layers[stage_name] = (stage_inputs, stage_layer)
+
+	stage_layer = stage_layers[stage_name][1]
+	if stage_name == 'draw_background':
+		return stage_layer.copy()
+	if stage_layer:
+		build_image.paste(stage_layer[0], stage_layer[2], stage_layer[1])
+	return build_image
+
+
+# get_layer_difference: crops layer_image down to the box around every pixel that differs from base_image, returning those pixels
+# as a (color image, mask, position) layer like the ones from get_template_layer, or None if nothing differs
+def get_layer_difference(layer_image, base_image):
+	red_difference, green_difference, blue_difference = ImageChops.difference(layer_image, base_image).split()
+	difference_mask = ImageChops.lighter(ImageChops.lighter(red_difference, green_difference), blue_difference).point(lambda difference: 255 if difference else 0)
+	difference_box = difference_mask.getbbox()
+	return difference_box and (layer_image.crop(difference_box), difference_mask.crop(difference_box), difference_box[:2])
+
+
+# make_background_layer: scales, crops and dims skin_image to fill an image of image_dimensions, returning it already composited onto the black base
+def make_background_layer(skin_image, image_dimensions = BUILD_IMAGE_DIMENSIONS):
+	# scale the skin image to fit the width of the build image
+	image_width, image_height = skin_image.size
+	scale_ratio = float(image_dimensions[0]) / image_width
+	skin_image = skin_image.resize((int(image_width * scale_ratio), int(image_height * scale_ratio)))
+
+	# then center and crop the skin image to fit the height of the build image
+	image_width, image_height = skin_image.size
+	height_difference = image_height - image_dimensions[1]
+	top_cut = height_difference / 2
+	bottom_cut = height_difference - top_cut
+	skin_image = skin_image.crop((0, top_cut, image_dimensions[0], image_height - bottom_cut))
+
+	# make it mostly transparent so it's not a distracting background
+	skin_image.putalpha(BACKGROUND_ALPHA)
+	background_layer = Image.new('RGB', image_dimensions, (0, 0, 0))
+	background_layer.paste(skin_image, (0, 0), skin_image)
+	return background_layer
+
+
+# draw_metadata: loads the metadata text from build_data and adds them to draw_operations in the corners, laid out by metadata_layout,
+# which is a list of (anchor corner, offset from it, build data key, header level) for each piece a game shows
+def draw_metadata(draw_operations, build_data, metadata_layout):
+	# draw each of the pieces offset from the specified corner
+	for text_anchor, text_offset, metadata_type, header_level in metadata_layout:
+		metadata_text = build_data.get(metadata_type)
+		if not metadata_text:
+			continue
+		draw_operations.append(('anchored_text', metadata_text, text_anchor, text_offset, FONT_SIZES[header_level]))
+	return draw_operations
+
+
+# get_images: looks up the (key, image url) pairs that page_extractor (one of page_extractors) found on wiki_page in its page index
+# (see get_page_index), creating a mapping of each key to the downloaded image located at its url; switches the key and value if
+# reverse_order is given, and applies any link_modifiers find:replace pairs to the url before downloading the image;
+# if wanted_keys is given, only the images for those keys get downloaded, so the cost scales with the build instead of the page;
+# the downloads themselves run concurrently, so a page costs about as much as its slowest few images rather than all of them;
+# any icon_operations (see process_icon) get applied to each image before it's handed back, and wiki_patch is the patch of the
+# build asking, which decides whether the page index is still good
+def get_images(page_extractors, wiki_page, page_extractor, reverse_order = False, link_modifiers = None, wanted_keys = None, icon_operations = None, wiki_patch = None):
+	with profile_span('get_images', wiki_page, wanted = None if wanted_keys is None else len(wanted_keys)):
+		image_links = get_image_links(page_extractors, wiki_page, page_extractor, reverse_order, link_modifiers, wiki_patch)
+		image_keys = [image_key for image_key in image_links if wanted_keys is None or image_key in wanted_keys]
+		downloaded_images = map_concurrently(
+			lambda image_link: get_processed_image(image_link, icon_operations),
+			[image_links[image_key] for image_key in image_keys]
+		)
+	return dict(zip(image_keys, downloaded_images)) # we create a mapping of each key to its downloaded image
+
+
+# resolve_build_assets: resolves every image the draw stages of game_plugin need for build_data before any of them run, giving
+# back the asset map (lookup name -> key -> image, for each of the plugin's get_image_lookups) along with the keys that couldn't be found
+# (lookup name -> set of keys); each page gets indexed once however many lookups share it, and then the images from every page
+# get downloaded together in one batch, rather than a page at a time as each stage gets to it; given lookup_names, only those
+# lookups get resolved, like the ones for a single stage
+def resolve_build_assets(game_plugin, build_data, lookup_names = None):
+	page_extractors = game_plugin.PAGE_EXTRACTORS
+	image_lookups = dict(
+		(lookup_name, image_lookup) for lookup_name, image_lookup in game_plugin.get_image_lookups(build_data).items()
+		if lookup_names is None or lookup_name in lookup_names
+	)
+	if not image_lookups:
+		return {}, {}
+	wiki_patches = dict((image_lookup[0], image_lookup[6]) for image_lookup in image_lookups.values())
+	wanted_count = sum(len(image_lookup[4]) for image_lookup in image_lookups.values())
+	with profile_span('get_images', ', '.join(sorted(wiki_patches)), wanted = wanted_count):
+		map_concurrently(lambda wiki_page: get_page_index(page_extractors, wiki_page, wiki_patches[wiki_page]), sorted(wiki_patches))
+
+		asset_links = [] # (lookup name, key, image url, icon operations) for each image that got found
+		unresolved_assets = {}
+		for lookup_name, image_lookup in image_lookups.items():
+			wiki_page, page_extractor, reverse_order, link_modifiers, wanted_keys, icon_operations, wiki_patch = image_lookup
+			image_links = get_image_links(page_extractors, wiki_page, page_extractor, reverse_order, link_modifiers, wiki_patch)
+			for image_key in wanted_keys:
+				if image_key in image_links:
+					asset_links.append((lookup_name, image_key, image_links[image_key], icon_operations))
+				else:
+					unresolved_assets.setdefault(lookup_name, set()).add(image_key)
+		asset_images = map_concurrently(lambda asset_link: get_processed_image(asset_link[2], asset_link[3]), asset_links)
+
+	build_assets = dict((lookup_name, {}) for lookup_name in image_lookups)
+	for (lookup_name, image_key, image_link, icon_operations), asset_image in zip(asset_links, asset_images):
+		build_assets[lookup_name][image_key] = asset_image
+	return build_assets, unresolved_assets
+
+
+# describe_error: gives the message of error, or its type for errors without one (like a MemoryError)
+def describe_error(error):
+	return str(error) or type(error).__name__
+
+
+# describe_unresolved_assets: sums up unresolved_assets (see resolve_build_assets) in a line, naming every key under its lookup
+def describe_unresolved_assets(unresolved_assets):
+	return '; '.join('%s: %s' % (lookup_name, ', '.join(sorted(image_keys))) for lookup_name, image_keys in sorted(unresolved_assets.items()))
+
+
+# map_concurrently: calls function on each of the given arguments using up to DOWNLOAD_CONCURRENCY threads, returning the results in order
+def map_concurrently(function, arguments):
+	if get_thread_count(min(DOWNLOAD_CONCURRENCY, len(arguments))) < 2:
+		return [function(argument) for argument in arguments]
+	thread_pool = ThreadPool(min(DOWNLOAD_CONCURRENCY, len(arguments)))
+	try:
+		return thread_pool.map(get_context_function(function), arguments, 1)
+	finally:
+		thread_pool.close()
+		thread_pool.join()
+
+
+# get_context_function: wraps function so each call runs in a copy of the calling thread's context, for handing it to a thread pool;
+# the pool's threads then count their stats towards the profile spans they're doing the work for (see count_stat)
+def get_context_function(function):
+	calling_context = contextvars.copy_context()
+	return lambda argument: calling_context.copy().run(function, argument)
+
+
+# get_thread_count: gives how many threads a pool that wants thread_count of them gets, which is just the calling thread in low memory
+# mode or under a memory limit; a thread that runs out of memory while starting up leaves whoever started it waiting forever,
+# so the limit has to be hit by image data rather than by a pool
+def get_thread_count(thread_count):
+	return 1 if LOW_MEMORY or MEMORY_LIMITED else thread_count
+
+
+# get_image_links: does the parsing half of get_images, creating the mapping of each key to its (modified) image url without downloading anything
+def get_image_links(page_extractors, wiki_page, page_extractor, reverse_order = False, link_modifiers = None, wiki_patch = None):
+	image_links = {}
+	for image_key, image_link in get_page_index(page_extractors, wiki_page, wiki_patch)['matches'][page_extractor]: # each pair is a link to an image and a way to refer to it (potentially reversed)
+		if image_key in image_links:
+			continue
+		if reverse_order:
+			image_key, image_link = image_link, image_key
+		if link_modifiers:
+			for old_regex, new_string in link_modifiers.items():
+				image_link = re.sub(old_regex, new_string, image_link)
+		image_links[image_key] = image_link
+	return image_links
+
+
+# get_page_index: returns the index of wiki_page, which maps the name of each of page_extractors to the (key, image url) pairs it found there;
+# indexing the page takes a single pass over it (see PageIndexParser), and the index is kept in memory and in the on-disk cache,
+# so renders after the first skip both downloading the page and scanning it; each index is tagged with the patch of the build it was made for,
+# and a build from a newer patch than that means the page has likely changed since, so it gets asked for again (even if the cached copy
+# is still fresh) and indexed over; builds from older patches use the newer index, since the wiki only ever has the latest images anyway;
+# each index also has the time it was made, and one older than CACHE_TTL gets made again, since it could have sat in memory (like in
+# the render service) for longer than its page would have stayed fresh in the on-disk cache
+def get_page_index(page_extractors, wiki_page, wiki_patch = None):
+	extractors_digest = get_extractors_digest(page_extractors)
+	page_index = recall_memory(('Index', wiki_page, extractors_digest))
+	if page_index is None:
+		cached_bytes = load_cached_bytes('index:' + wiki_page)
+		if cached_bytes is not None:
+			page_index = json.loads(cached_bytes.decode('utf-8'))
+			if page_index.get('extractors') == extractors_digest: # otherwise it might be missing some of what the current ones find
+				remember_memory(('Index', wiki_page, extractors_digest), page_index)
+			else:
+				page_index = None
+	if page_index is not None and time.time() - page_index.get('fetched', 0) >= CACHE_TTL:
+		page_index = None # its page has to be revalidated first (see fetch_url), in case the wiki changed it since
+	outdated = page_index is not None and is_newer_patch(wiki_patch, page_index['patch'])
+	if page_index is None or outdated:
+		index_parser = PageIndexParser(page_extractors)
+		index_parser.feed(fetch_url(wiki_page, outdated).decode('utf-8'))
+		index_parser.close()
+		page_index = { 'patch': wiki_patch, 'extractors': extractors_digest, 'fetched': time.time(), 'matches': index_parser.page_matches }
+		store_cache_blob('index:' + wiki_page, json.dumps(page_index).encode('utf-8'))
+		remember_memory(('Index', wiki_page, extractors_digest), page_index)
+		count_stat('scanned')
+	return page_index
+
+
+# get_extractors_digest: gives a short hash of page_extractors, so page indexes made with different ones (like another game's) can be told apart
+def get_extractors_digest(page_extractors):
+	return hashlib.sha256(json.dumps(page_extractors, sort_keys = True).encode('utf-8')).hexdigest()[:16]
+
+
+# is_newer_patch: whether the build patch wiki_patch (like v12.13 or 7.28a) came out after index_patch; builds without a patch
+# never are, since there's nothing to go by, while any patch is newer than an index that was made without one
+def is_newer_patch(wiki_patch, index_patch):
+	patch_version = get_patch_version(wiki_patch)
+	return bool(patch_version) and patch_version > (get_patch_version(index_patch) or [])
+
+
+# get_patch_version: splits wiki_patch into a list of its (number, letters) parts, which sort in the order the patches came out
+def get_patch_version(wiki_patch):
+	return [(int(version_number), version_letters) for version_number, version_letters in re.findall(r'(\d+)([a-z]*)', (wiki_patch or '').lower())]
+
+
+# PageIndexParser: runs every one of a game's page_extractors over a wiki page in a single pass of html parsing, collecting what each one
+# extracts in page_matches (extractor name -> list of the values it captured at each match); an extractor is a sequence of fields
+# that have to come up in order, each one (tag name, or None for any tag; ((attribute name, or None for the tag's text, pattern), ...)),
+# matching a tag whose attributes (and text) all fully match their patterns, and capturing whatever groups those patterns have;
+# since every field only ever looks at a single tag, the whole page takes time in line with its length, and extra markup in between
+# doesn't throw anything off; lazily loaded images have their real url in data-src, so that stands in for src wherever it's there
+class PageIndexParser(HTMLParser):
+	def __init__(self, page_extractors):
+		HTMLParser.__init__(self)
+		self.page_extractors = page_extractors
+		self.page_matches = dict((extractor_name, []) for extractor_name in page_extractors)
+		self.extractor_states = dict((extractor_name, (0, [])) for extractor_name in page_extractors) # (the next field to match, what's been captured so far)
+		self.text_tag = None # the (tag name, attributes) of the last start tag, while its text is still coming in
+		self.text_parts = []
+
+	def handle_starttag(self, tag_name, tag_attributes):
+		self.finish_text()
+		attributes = dict(tag_attributes)
+		if attributes.get('data-src'):
+			attributes['src'] = attributes['data-src']
+		for extractor_name in self.page_extractors:
+			self.match_fields(extractor_name, tag_name, attributes, None)
+		self.text_tag = (tag_name, attributes)
+
+	def handle_endtag(self, tag_name):
+		self.finish_text()
+
+	def handle_data(self, data):
+		if self.text_tag:
+			self.text_parts.append(data)
+
+	def finish_text(self):
+		tag_text = ''.join(self.text_parts).strip()
+		if self.text_tag and tag_text:
+			for extractor_name in self.page_extractors:
+				self.match_fields(extractor_name, self.text_tag[0], self.text_tag[1], tag_text)
+		self.text_tag = None
+		self.text_parts = []
+
+	# match_fields: moves extractor_name along as far as the tag (or its text) matches its fields, starting it over if the tag
+	# begins another match instead (like a key whose image never showed up), and records the captures once every field matched
+	def match_fields(self, extractor_name, tag_name, attributes, tag_text):
+		extractor_fields = self.page_extractors[extractor_name]
+		field_index, field_captures = self.extractor_states[extractor_name]
+		if field_index and match_page_field(extractor_fields[field_index], tag_name, attributes, tag_text) is None:
+			if match_page_field(extractor_fields[0], tag_name, attributes, tag_text) is not None:
+				field_index, field_captures = 0, []
+		while field_index < len(extractor_fields):
+			tag_captures = match_page_field(extractor_fields[field_index], tag_name, attributes, tag_text)
+			if tag_captures is None:
+				break
+			field_index, field_captures = field_index + 1, field_captures + tag_captures # the next field can match the same tag
+		if field_index == len(extractor_fields):
+			self.page_matches[extractor_name].append(tuple(field_captures))
+			field_index, field_captures = 0, []
+		self.extractor_states[extractor_name] = (field_index, field_captures)
+
+
+# match_page_field: gives the list of groups captured if page_field (see PageIndexParser) matches the tag named tag_name with attributes,
+# or None if it doesn't; fields with a pattern for the text only match once tag_text is known, and the rest only match before that
+def match_page_field(page_field, tag_name, attributes, tag_text):
+	field_tag, field_patterns = page_field
+	if field_tag and field_tag != tag_name:
+		return None
+	if (tag_text is None) != all(attribute_name for attribute_name, value_pattern in field_patterns):
+		return None
+	tag_captures = []
+	for attribute_name, value_pattern in field_patterns:
+		attribute_value = tag_text if attribute_name is None else attributes.get(attribute_name)
+		value_match = attribute_value is not None and re.match(r'(?:%s)\Z' % value_pattern, attribute_value)
+		if not value_match:
+			return None
+		tag_captures.extend(value_match.groups())
+	return tag_captures
+
+
+# get_image: downloads and decodes the image at image_link, only doing so once for each link while it's remembered;
+# the same image object gets handed out every time, so callers should copy it before modifying it in place
+def get_image(image_link):
+	image = recall_memory(('Image', image_link))
+	if image is None:
+		image = decode_image(fetch_url(image_link)) # decode it now, in whichever thread downloaded it, rather than lazily on first use
+		if not LOW_MEMORY: # which only remembers the compressed bytes (see get_encoded_image)
+			remember_memory(('Image', image_link), image)
+	return image
+
+
+# get_processed_image: returns the image at image_link with icon_operations applied, only processing each (link, operations) pair once
+# while it's remembered; the result is shared just like the ones from get_image, so it shouldn't be modified in place either;
+# in low memory mode it's the compressed bytes of the image instead (see get_encoded_image), which decode_image turns back into one
+def get_processed_image(image_link, icon_operations):
+	if LOW_MEMORY:
+		return get_encoded_image(image_link, icon_operations)
+	if not icon_operations:
+		return get_image(image_link)
+	processed_key = ('Icon', image_link, icon_operations)
+	image = recall_memory(processed_key)
+	if image is None:
+		image = remember_memory(processed_key, process_icon(get_image(image_link), icon_operations))
+	return image
+
+
+# get_encoded_image: the low memory mode half of get_processed_image, which gives the image at image_link with icon_operations applied
+# as compressed bytes, so only the images being pasted at any one time ever take up their decoded size; unprocessed images are just
+# the downloaded bytes, and processed ones get encoded as png, which is lossless, so both decode to exactly the same pixels as before
+def get_encoded_image(image_link, icon_operations):
+	encoded_key = ('Encoded', image_link, icon_operations)
+	image_bytes = recall_memory(encoded_key)
+	if image_bytes is None:
+		if icon_operations:
+			image_buffer = io.BytesIO()
+			process_icon(get_image(image_link), icon_operations).save(image_buffer, 'PNG', compress_level = 1) # the cheapest to encode, like the layers
+			image_bytes = image_buffer.getvalue()
+		else:
+			image_bytes = fetch_url(image_link)
+		remember_memory(encoded_key, image_bytes)
+	return image_bytes
+
+
+# decode_image: decodes image_asset, which is either the compressed bytes of an image (see get_encoded_image) or an image that's
+# already decoded (or None), which gets handed back as it is; given draft_width, a jpeg at least twice that wide gets decoded at
+# the largest power of two reduction that's still at least that wide, so oversize splash art never gets decoded at full size
+def decode_image(image_asset, draft_width = None):
+	if not isinstance(image_asset, bytes):
+		return image_asset
+	image = Image.open(io.BytesIO(image_asset))
+	image_width, image_height = image.size
+	if draft_width and image_width >= 2 * draft_width:
+		image.draft(image.mode, (draft_width, (image_height * draft_width + image_width - 1) // image_width)) # only jpegs can do this
+	image.load()
+	count_stat('decoded')
+	return image
+
+
+# process_icon: applies each (operation name, arguments...) step of icon_operations to image in turn, returning a new image;
+# each step works on the whole image at once (no python loops over pixels), and the supported steps are:
+#   ('threshold', alpha)     clears every pixel that's less opaque than alpha, like the half-transparent backgrounds of the rune paths
+#   ('resize', size)         scales the image to the (width, height) in size
+#   ('expand', border, fill) adds a border of border pixels in the fill color around the image
+#   ('convert', mode)        converts the image to the given PIL mode
+def process_icon(image, icon_operations):
+	for icon_operation in icon_operations:
+		operation_name, operation_arguments = icon_operation[0], icon_operation[1:]
+		if operation_name == 'threshold':
+			image = image.convert('RGBA') # this copies the image, even if it's already RGBA
+			alpha_threshold = operation_arguments[0]
+			transparent_mask = image.getchannel('A').point(lambda alpha: 255 if alpha < alpha_threshold else 0)
+			image.paste((0, 0, 0, 0), None, transparent_mask)
+		elif operation_name == 'resize':
+			image = image.resize(operation_arguments[0])
+		elif operation_name == 'expand':
+			image = ImageOps.expand(image, operation_arguments[0], operation_arguments[1])
+		elif operation_name == 'convert':
+			image = image.convert(operation_arguments[0])
+		else:
+			raise ValueError('unknown icon operation "%s"' % operation_name)
+	return image
+
+
+# get_cached_layer: returns the finished layer for layer_key (a tuple of everything it depends on) from memory or the on-disk cache,
+# only calling get_source (for the image it's made from) and make_layer (to turn that into the layer) if it's in neither;
+# nothing gets cached if get_source comes up empty, so the next render gets another try at it
+def get_cached_layer(layer_key, get_source, make_layer):
+	layer = recall_memory(('Layer', layer_key))
+	if layer is None:
+		cache_key = 'layer:' + json.dumps(layer_key)
+		cached_bytes = load_cached_bytes(cache_key)
+		if cached_bytes is not None:
+			layer = Image.open(io.BytesIO(cached_bytes))
+			layer.load()
+			count_stat('decoded')
+		else:
+			source_image = get_source()
+			if not source_image:
+				return None
+			layer = make_layer(source_image)
+			layer_buffer = io.BytesIO()
+			layer.save(layer_buffer, 'PNG', compress_level = 1) # it's lossless either way, and this is the cheapest to encode
+			store_cache_blob(cache_key, layer_buffer.getvalue())
+		remember_memory(('Layer', layer_key), layer)
+	return layer
+
+
+# recall_memory: returns the value remembered under memo_key (a tuple that starts with what kind of value it is), marking it
+# as the most recently used, or default if it was never remembered or has been forgotten since
+def recall_memory(memo_key, default = None):
+	with MEMORY_LOCK:
+		if memo_key not in MEMORY_CACHE:
+			return default
+		MEMORY_CACHE[memo_key] = MEMORY_CACHE.pop(memo_key)
+		return MEMORY_CACHE[memo_key][0]
+
+
+# remember_memory: keeps value in memory under memo_key and returns it, then forgets the least recently used values until everything
+# fits in MEMORY_BYTE_BUDGET again; forgetting something only means redoing it from the on-disk cache the next time it's needed
+def remember_memory(memo_key, value):
+	global MEMORY_CACHE_BYTES
+	value_bytes = estimate_memory_bytes(value)
+	with MEMORY_LOCK:
+		if memo_key in MEMORY_CACHE:
+			MEMORY_CACHE_BYTES -= MEMORY_CACHE.pop(memo_key)[1]
+		MEMORY_CACHE[memo_key] = (value, value_bytes)
+		MEMORY_CACHE_BYTES += value_bytes
+		while MEMORY_CACHE_BYTES > MEMORY_BYTE_BUDGET and len(MEMORY_CACHE) > 1:
+			MEMORY_CACHE_BYTES -= MEMORY_CACHE.popitem(False)[1][1]
+	return value
+
+
+# estimate_memory_bytes: roughly how much memory value takes up, counting the pixels of images, the characters of text like page indexes,
+# the length of compressed images and the size of font files (and of anything inside tuples, lists and dicts of them), which are the only
+# things big enough to matter
+def estimate_memory_bytes(value):
+	if isinstance(value, (tuple, list)):
+		return sum(estimate_memory_bytes(part) for part in value)
+	if isinstance(value, dict):
+		return sum(estimate_memory_bytes(key) + estimate_memory_bytes(part) for key, part in value.items())
+	if isinstance(value, Image.Image):
+		return value.size[0] * value.size[1] * len(value.getbands())
+	if isinstance(value, bytes):
+		return len(value)
+	if isinstance(value, type(u'')):
+		return len(value)
+	if isinstance(value, ImageFont.FreeTypeFont):
+		return os.path.getsize(value.path)
+	return 0
+
+
+# fetch_url: returns the body at url as bytes, going to the asset bundle first if there is one, and then through the on-disk
+# cache so that fresh entries skip the network entirely, and stale ones (older than CACHE_TTL) only get downloaded again if the server says they've changed;
+# revalidate treats even a fresh entry as stale; this gets called from several download threads at once, so anything touching the index holds CACHE_LOCK
+def fetch_url(url, revalidate = False):
+	bundled_bytes = read_bundle_entry(url)
+	if bundled_bytes is not None:
+		count_stat('bundled')
+		return bundled_bytes
+
+	cached_bytes = None if revalidate else load_cached_bytes(url)
+	if cached_bytes is not None:
+		return cached_bytes
+
+	# the entry is either missing or stale, so ask the server, conditionally if we have something to fall back on
+	with CACHE_LOCK:
+		cache_entry = load_cache_index().get(url)
+		cache_entry = dict(cache_entry) if cache_entry else None
+	request_headers = {}
+	if cache_entry and cache_entry.get('etag'):
+		request_headers['If-None-Match'] = cache_entry['etag']
+	if cache_entry and cache_entry.get('last_modified'):
+		request_headers['If-Modified-Since'] = cache_entry['last_modified']
+	try:
+		with DOWNLOAD_SLOTS:
+			response = count_response(get_http_session().get(url, headers = request_headers, timeout = HTTP_TIMEOUT))
+	except requests.RequestException:
+		cached_bytes = read_cache_blob(cache_entry) if cache_entry else None
+		if cached_bytes is None:
+			raise
+		touch_cache_entry(url, 'stale') # better a slightly old image than no image at all
+		return cached_bytes
+
+	if response.status_code == 304:
+		cached_bytes = read_cache_blob(cache_entry)
+		if cached_bytes is not None:
+			touch_cache_entry(url, 'revalidated', True)
+			return cached_bytes
+		with DOWNLOAD_SLOTS:
+			response = count_response(get_http_session().get(url, timeout = HTTP_TIMEOUT)) # the blob went missing from under us, so we need the full body after all
+	response.raise_for_status()
+
+	store_cache_blob(url, response.content, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+	return response.content
+
+
+# count_response: counts response as a request that went out over the network in CACHE_STATS, along with the size of its body, and returns it
+def count_response(response):
+	count_stat('requests')
+	count_stat('downloaded', len(response.content))
+	return response
+
+
+# load_cached_bytes: returns the body stored in the on-disk cache under cache_key (a url, or the key of something derived from one)
+# if it's younger than CACHE_TTL, or None if there's nothing fresh there; this never touches the network
+def load_cached_bytes(cache_key):
+	with CACHE_LOCK:
+		cache_entry = load_cache_index().get(cache_key)
+		cache_entry = dict(cache_entry) if cache_entry else None
+	if cache_entry and time.time() - cache_entry['fetched'] < CACHE_TTL:
+		cached_bytes = read_cache_blob(cache_entry)
+		if cached_bytes is not None:
+			touch_cache_entry(cache_key, 'hits')
+			return cached_bytes
+	return None
+
+
+# get_build_urls: gives every url game_plugin draws build_data from, split into the urls the builds actually need, which are the page
+# for each of its image lookups, the images it wants from them and any of the plugin's other asset urls (see get_asset_urls in each game),
+# and every other image url on those pages, which only get bundled so other builds can use the same pages; that's everything a snapshot needs
+def get_build_urls(game_plugin, build_data):
+	needed_urls = set(game_plugin.get_asset_urls(build_data))
+	extra_urls = set()
+	for wiki_page, page_extractor, reverse_order, link_modifiers, wanted_keys, icon_operations, wiki_patch in game_plugin.get_image_lookups(build_data).values():
+		needed_urls.add(wiki_page)
+		for image_key, image_link in get_image_links(game_plugin.PAGE_EXTRACTORS, wiki_page, page_extractor, reverse_order, link_modifiers, wiki_patch).items():
+			(needed_urls if image_key in wanted_keys else extra_urls).add(image_link)
+	return needed_urls, extra_urls - needed_urls
+
+
+# write_asset_bundle: packs the body of every url in urls and extra_urls into a single file at bundle_filepath, tagged with bundle_patches;
+# the file is BUNDLE_MAGIC, then the offset and length of its json index, then the raw bodies (identical ones only stored once),
+# then the index itself, which maps each url to the (offset, length) of its body; any url in urls that can't be fetched fails the
+# whole bundle, but ones in extra_urls just get left out; returns that mapping, along with the extra urls that got left out
+def write_asset_bundle(bundle_filepath, urls, bundle_patches, extra_urls = ()):
+	urls = sorted(urls)
+	extra_urls = sorted(set(extra_urls) - set(urls))
+	skipped_urls = {}
+
+	# try_fetch_url: fetches one of the extra urls, noting down why it couldn't be fetched instead of raising
+	def try_fetch_url(url):
+		try:
+			return len(fetch_url(url))
+		except (IOError, OSError, requests.RequestException) as fetch_error:
+			skipped_urls[url] = describe_error(fetch_error)
+			return None
+
+	map_concurrently(lambda url: len(fetch_url(url)), urls) # get everything into the cache first, so the writes below don't wait on downloads
+	map_concurrently(try_fetch_url, extra_urls)
+	bundle_entries = {}
+	blob_offsets = {} # body hash -> (offset, length)
+	with open(get_temporary_filepath(bundle_filepath), 'wb') as bundle_filehandle:
+		bundle_filehandle.write(BUNDLE_MAGIC + struct.pack(BUNDLE_HEADER_FORMAT, 0, 0)) # filled in once the index has been written
+		for url in urls + [url for url in extra_urls if url not in skipped_urls]:
+			body = fetch_url(url)
+			blob_hash = hashlib.sha256(body).hexdigest()
+			if blob_hash not in blob_offsets:
+				blob_offsets[blob_hash] = (bundle_filehandle.tell(), len(body))
+				bundle_filehandle.write(body)
+			bundle_entries[url] = blob_offsets[blob_hash]
+		index_bytes = json.dumps({ 'patches': sorted(bundle_patches), 'created': time.time(), 'entries': bundle_entries }).encode('utf-8')
+		index_offset = bundle_filehandle.tell()
+		bundle_filehandle.write(index_bytes)
+		bundle_filehandle.seek(len(BUNDLE_MAGIC))
+		bundle_filehandle.write(struct.pack(BUNDLE_HEADER_FORMAT, index_offset, len(index_bytes)))
+	os.rename(bundle_filehandle.name, bundle_filepath)
+	return bundle_entries, skipped_urls
+
+
+# open_asset_bundle: loads the asset bundle at bundle_filepath (see load_asset_bundle), making every later fetch_url look there first;
+# returns the bundle's whole index, patches and all
+def open_asset_bundle(bundle_filepath):
+	global ASSET_BUNDLE, BUNDLE_FILEPATH
+	bundle_map, bundle_index = load_asset_bundle(bundle_filepath)
+	with CACHE_LOCK:
+		ASSET_BUNDLE = (bundle_map, bundle_index['entries'])
+		BUNDLE_FILEPATH = bundle_filepath
+	return bundle_index
+
+
+# load_asset_bundle: memory maps the asset bundle at bundle_filepath and reads its index, returning both; only the index gets read now,
+# and each body (at the (offset, length) the index has for its url) only gets paged in when it's sliced out of the map
+def load_asset_bundle(bundle_filepath):
+	with open(bundle_filepath, 'rb') as bundle_filehandle:
+		bundle_map = mmap.mmap(bundle_filehandle.fileno(), 0, access = mmap.ACCESS_READ) # the map stays valid after the file gets closed
+	header_end = len(BUNDLE_MAGIC) + struct.calcsize(BUNDLE_HEADER_FORMAT)
+	if bundle_map[:len(BUNDLE_MAGIC)] != BUNDLE_MAGIC:
+		bundle_map.close()
+		raise ValueError('"%s" is not an asset bundle' % bundle_filepath)
+	index_offset, index_length = struct.unpack(BUNDLE_HEADER_FORMAT, bundle_map[len(BUNDLE_MAGIC):header_end])
+	return bundle_map, json.loads(bundle_map[index_offset:index_offset + index_length].decode('utf-8'))
+
+
+# read_bundle_entry: returns the body bundled for url, or None if there's no bundle or it doesn't have url;
+# the bundle at BUNDLE_FILEPATH gets opened the first time this is called
+def read_bundle_entry(url):
+	with CACHE_LOCK:
+		if ASSET_BUNDLE is None and BUNDLE_FILEPATH:
+			open_asset_bundle(BUNDLE_FILEPATH)
+		asset_bundle = ASSET_BUNDLE
+	if asset_bundle is None or url not in asset_bundle[1]:
+		return None
+	entry_offset, entry_length = asset_bundle[1][url]
+	return asset_bundle[0][entry_offset:entry_offset + entry_length]
+
+
+# set_profiling: turns profile_span on (starting over with no spans) or off
+def set_profiling(profiling):
+	global PROFILE_SPANS
+	PROFILE_SPANS = [] if profiling else None
+
+
+# set_memory_mode: turns low memory mode on or off (see get_processed_image), and given memory_limit, caps the data memory
+# (the heap and other private writable mappings, which is where decoded images go) of this process and of any workers it starts
+# afterwards at that many bytes, so a render that would go over fails with a MemoryError instead of the whole process getting
+# killed; the memory budget shrinks to a quarter of the limit too, so remembered values get forgotten well before then, stages
+# and downloads stop getting threads of their own (see get_thread_count), and any other threads started from then on get smaller
+# stacks, since those count towards the limit as well; raises ValueError if the limit can't be set here
+def set_memory_mode(low_memory, memory_limit = None):
+	global LOW_MEMORY, MEMORY_LIMITED, MEMORY_BYTE_BUDGET
+	LOW_MEMORY = low_memory
+	if low_memory or memory_limit:
+		threading.stack_size(LOW_MEMORY_STACK_SIZE)
+	if not memory_limit:
+		return
+	if resource is None:
+		raise ValueError('memory limits are only supported on unix')
+	resource.setrlimit(resource.RLIMIT_DATA, (memory_limit, resource.getrlimit(resource.RLIMIT_DATA)[1])) # the hard limit stays as it was
+	MEMORY_LIMITED = True
+	MEMORY_BYTE_BUDGET = min(MEMORY_BYTE_BUDGET, memory_limit // 4)
+
+
+# profile_span: while profiling is on, records the code run in the with block as a span of span_kind named span_name (with any
+# span_details), which is a dict of when it started, how long it took, what it did to CACHE_STATS in the meantime and the peak
+# memory use by the end of it; the stats only count work done inside the span, including on the pool threads it hands work to
+# (see get_context_function), so stages running side by side don't count each other's downloads and decodes
+@contextlib.contextmanager
+def profile_span(span_kind, span_name, **span_details):
+	if PROFILE_SPANS is None:
+		yield
+		return
+	open_span_stats = dict.fromkeys(CACHE_STATS, 0)
+	span_token = OPEN_SPAN_STATS.set(OPEN_SPAN_STATS.get() + (open_span_stats,))
+	start_time = time.time()
+	try:
+		yield
+	finally:
+		end_time = time.time()
+		OPEN_SPAN_STATS.reset(span_token)
+		with CACHE_LOCK:
+			span_stats = dict(open_span_stats)
+		span_details.update(kind = span_kind, name = span_name, start = start_time, duration = end_time - start_time, stats = span_stats, peak_memory = get_peak_memory())
+		PROFILE_SPANS.append(span_details)
+
+
+# count_stat: adds stat_count to stat_name in CACHE_STATS, and to the stats of every profile span the calling code is running in
+def count_stat(stat_name, stat_count = 1):
+	with CACHE_LOCK:
+		CACHE_STATS[stat_name] += stat_count
+		for open_span_stats in OPEN_SPAN_STATS.get():
+			open_span_stats[stat_name] += stat_count
+
+
+# get_peak_memory: gives the most memory in bytes this process has used at once so far, or None where that can't be asked for
+def get_peak_memory():
+	if resource is None:
+		return None
+	peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return peak_memory if sys.platform == 'darwin' else peak_memory * 1024 # it's in bytes on macs, but kilobytes everywhere else
+
+
+# get_http_session: returns the session that every request goes through, creating it on first use; sharing it means connections
+# to each host get pooled and kept alive, and every request gets the same timeouts and retries (with backoff) on 429s and 5xxs
+def get_http_session():
+	global HTTP_SESSION
+	with HTTP_SESSION_LOCK:
+		if HTTP_SESSION is None:
+			http_transport = HTTP_TRANSPORT or HTTPAdapter(
+				pool_connections = 4, # one per host we talk to (the wiki, its image server and the odd background or talent tree host)
+				pool_maxsize = max(DOWNLOAD_CONCURRENCY, 1), # so every download thread can keep its own connection to the image server
+				max_retries = Retry(
+					total = HTTP_RETRIES,
+					backoff_factor = HTTP_RETRY_BACKOFF,
+					status_forcelist = (429, 500, 502, 503, 504)
+				)
+			)
+			HTTP_SESSION = requests.Session()
+			HTTP_SESSION.mount('http://', http_transport)
+			HTTP_SESSION.mount('https://', http_transport)
+		return HTTP_SESSION
+
+
+# set_http_transport: makes every request go through http_transport (any requests transport adapter, like one pointed at a local
+# stand-in for the wikis) instead of the default pooled one; passing None goes back to the default
+def set_http_transport(http_transport):
+	global HTTP_SESSION, HTTP_TRANSPORT
+	with HTTP_SESSION_LOCK:
+		HTTP_TRANSPORT = http_transport
+		HTTP_SESSION = None
+
+
+# reset_http_session: drops the current session so the next request opens fresh connections, which forked worker processes
+# need to do rather than sharing their parent's sockets
+def reset_http_session():
+	global HTTP_SESSION
+	with HTTP_SESSION_LOCK:
+		HTTP_SESSION = None
+
+
+# touch_cache_entry: counts a use of the cached entry for url under stat_name and bumps its access time for eviction,
+# also resetting its fetch time if it was just revalidated with the server; either gets saved along with the next store
+def touch_cache_entry(url, stat_name, revalidated = False):
+	with CACHE_LOCK:
+		count_stat(stat_name)
+		cache_entry = load_cache_index().get(url)
+		if cache_entry:
+			cache_entry['accessed'] = time.time()
+			CACHE_CHANGES[url] = cache_entry
+			if revalidated:
+				cache_entry['fetched'] = cache_entry['accessed']
+
+
+# load_cache_index: reads the on-disk cache index (a mapping of each url to the metadata of its cached body) the first time it's needed
+def load_cache_index():
+	global CACHE_INDEX
+	with CACHE_LOCK:
+		if CACHE_INDEX is None:
+			CACHE_INDEX = read_cache_index()
+			count_cache_blobs()
+		return CACHE_INDEX
+
+
+# count_cache_blobs: works out CACHE_BLOBS and CACHE_BYTES from scratch for the entries in CACHE_INDEX, after it gets (re)loaded
+def count_cache_blobs():
+	global CACHE_BYTES
+	CACHE_BLOBS.clear()
+	for cache_entry in CACHE_INDEX.values():
+		CACHE_BLOBS.setdefault(cache_entry['blob'], [cache_entry['size'], 0])[1] += 1
+	CACHE_BYTES = sum(blob_size for blob_size, reference_count in CACHE_BLOBS.values())
+
+
+# set_cache_entry: puts cache_entry in the index under url, or takes url out of it if cache_entry is None, keeping CACHE_BLOBS
+# and CACHE_BYTES up to date; the blob of whatever entry was there before goes in CACHE_DROPPED_BLOBS, for save_cache_index
+# to delete if the merged index doesn't point to it anymore either; callers should be holding CACHE_LOCK
+def set_cache_entry(url, cache_entry):
+	global CACHE_BYTES
+	cache_index = load_cache_index()
+	old_entry = cache_index.pop(url, None)
+	if cache_entry is not None:
+		CACHE_CHANGES[url] = cache_entry
+		CACHE_EVICTIONS.pop(url, None)
+		cache_index[url] = cache_entry
+		blob_count = CACHE_BLOBS.setdefault(cache_entry['blob'], [cache_entry['size'], 0])
+		if not blob_count[1]:
+			CACHE_BYTES += blob_count[0]
+		blob_count[1] += 1
+	elif old_entry is not None:
+		CACHE_CHANGES.pop(url, None)
+		CACHE_EVICTIONS[url] = old_entry
+	if old_entry is not None:
+		CACHE_DROPPED_BLOBS.add(old_entry['blob'])
+		blob_count = CACHE_BLOBS[old_entry['blob']]
+		blob_count[1] -= 1
+		if not blob_count[1]:
+			CACHE_BYTES -= CACHE_BLOBS.pop(old_entry['blob'])[0]
+
+
+# read_cache_index: gives the cache index as it is on disk right now, or an empty one if there isn't one yet
+def read_cache_index():
+	try:
+		with open(os.path.join(CACHE_DIRECTORY, 'index.json')) as index_filehandle:
+			return json.load(index_filehandle)
+	except (IOError, OSError, ValueError):
+		return {}
+
+
+# save_cache_index: writes the cache index back to disk, going through a temporary file so a crash can't leave it half-written;
+# other processes (like the workers of render_builds) share the same cache, so rather than overwriting what they saved, this
+# merges the changes in CACHE_CHANGES and CACHE_EVICTIONS into the index on disk while holding a lock on it (see merge_cache_changes),
+# evicts from the merged index, which has every process's blobs in it, and then deletes the blobs it doesn't point to (see delete_cache_blobs);
+# the cache is only there to save time, so if it can't be written this warns and carries on
+def save_cache_index():
+	global CACHE_INDEX, CACHE_UNSAVED_STORES
+	with CACHE_LOCK:
+		if CACHE_INDEX is None:
+			return
+		CACHE_UNSAVED_STORES = 0
+		try:
+			os.makedirs(CACHE_DIRECTORY)
+		except OSError:
+			pass # it already exists, or another process just made it (and if neither, opening the lock file says so)
+		index_filepath = os.path.join(CACHE_DIRECTORY, 'index.json')
+		try:
+			with open(index_filepath + '.lock', 'a') as lock_filehandle:
+				if fcntl is not None:
+					fcntl.flock(lock_filehandle, fcntl.LOCK_EX) # released when the lock file gets closed
+				CACHE_INDEX = read_cache_index()
+				merge_cache_changes()
+				count_cache_blobs()
+				evict_cache_entries()
+				with open(get_temporary_filepath(index_filepath), 'w') as index_filehandle:
+					json.dump(CACHE_INDEX, index_filehandle)
+				os.rename(index_filehandle.name, index_filepath)
+				CACHE_CHANGES.clear()
+				CACHE_EVICTIONS.clear()
+				delete_cache_blobs()
+		except OSError as write_error:
+			warn_cache_write(write_error)
+
+
+# merge_cache_changes: applies CACHE_CHANGES and CACHE_EVICTIONS to CACHE_INDEX, freshly read from disk; another process may have
+# stored a newer entry for the same url since this one last saw it, so a change only wins if it's been fetched at least as recently
+# as what's on disk, and an eviction only applies if the entry on disk is still the one that got evicted; callers should be holding CACHE_LOCK
+def merge_cache_changes():
+	for url, cache_entry in CACHE_CHANGES.items():
+		disk_entry = CACHE_INDEX.get(url)
+		if disk_entry and disk_entry['blob'] != cache_entry['blob'] and disk_entry['fetched'] > cache_entry['fetched']:
+			CACHE_DROPPED_BLOBS.add(cache_entry['blob'])
+			continue
+		if disk_entry:
+			CACHE_DROPPED_BLOBS.add(disk_entry['blob'])
+		CACHE_INDEX[url] = cache_entry
+	for url, evicted_entry in CACHE_EVICTIONS.items():
+		disk_entry = CACHE_INDEX.get(url)
+		if disk_entry and disk_entry['blob'] == evicted_entry['blob'] and disk_entry['fetched'] == evicted_entry['fetched']:
+			del CACHE_INDEX[url]
+
+
+# delete_cache_blobs: deletes the blobs in CACHE_DROPPED_BLOBS that the just saved CACHE_INDEX doesn't point to, along with any other
+# blob it doesn't point to that's older than CACHE_ORPHAN_AGE (left by a crash, say); newer ones might belong to entries that another
+# process hasn't saved yet, so those are left for later; callers should be holding CACHE_LOCK and the lock on the index
+def delete_cache_blobs():
+	orphan_time = time.time() - CACHE_ORPHAN_AGE
+	for blob_filepath in glob.glob(get_cache_blob_filepath('??*')):
+		blob_hash = os.path.basename(blob_filepath)
+		if blob_hash in CACHE_BLOBS or blob_hash.endswith('.tmp'):
+			continue
+		try:
+			if blob_hash in CACHE_DROPPED_BLOBS or os.path.getmtime(blob_filepath) < orphan_time:
+				os.remove(blob_filepath)
+		except OSError:
+			pass # another process got there first
+	CACHE_DROPPED_BLOBS.clear()
+
+
+# warn_cache_write: prints a warning that write_error stopped something from getting written to the cache, but only the first time,
+# since everything after it will most likely fail the same way (like with a read-only checkout); renders carry on uncached either way
+def warn_cache_write(write_error):
+	global CACHE_WRITE_FAILED
+	with CACHE_LOCK:
+		if not CACHE_WRITE_FAILED:
+			CACHE_WRITE_FAILED = True
+			print('Warning: could not write to the cache in "%s", so carrying on without it: %s' % (CACHE_DIRECTORY, write_error))
+
+
+# get_temporary_filepath: gives a filepath next to filepath to write to before renaming it into place, unique to this process and thread
+def get_temporary_filepath(filepath):
+	return '%s.%d.%d.tmp' % (filepath, os.getpid(), threading.current_thread().ident)
+
+
+# get_cache_blob_filepath: blobs are content-addressed, so urls with identical bodies (like a rewritten link to the same image) share a file
+def get_cache_blob_filepath(blob_hash):
+	return os.path.join(CACHE_DIRECTORY, 'blobs', blob_hash[:2], blob_hash)
+
+
+# read_cache_blob: returns the cached body for cache_entry, or None if its blob has gone missing
+def read_cache_blob(cache_entry):
+	try:
+		with open(get_cache_blob_filepath(cache_entry['blob']), 'rb') as blob_filehandle:
+			return blob_filehandle.read()
+	except (IOError, OSError):
+		return None
+
+
+# store_cache_blob: saves body as the cached response for url, evicting old entries if that pushed the cache over budget,
+# and saves the index every CACHE_SAVE_INTERVAL stores; if the blob can't be written, it just doesn't get cached (see warn_cache_write)
+def store_cache_blob(url, body, etag = None, last_modified = None):
+	global CACHE_UNSAVED_STORES
+	blob_hash = hashlib.sha256(body).hexdigest()
+	blob_filepath = get_cache_blob_filepath(blob_hash)
+	if os.path.exists(blob_filepath):
+		try:
+			os.utime(blob_filepath) # so it doesn't look like an orphan (see delete_cache_blobs) before this entry gets saved
+		except OSError:
+			pass
+	else:
+		try:
+			os.makedirs(os.path.dirname(blob_filepath))
+		except OSError:
+			pass # another thread or process got there first (and if not, writing the blob says so)
+		try:
+			with open(get_temporary_filepath(blob_filepath), 'wb') as blob_filehandle:
+				blob_filehandle.write(body)
+			os.rename(blob_filehandle.name, blob_filepath)
+		except OSError as write_error:
+			warn_cache_write(write_error)
+			count_stat('misses')
+			return
+
+	with CACHE_LOCK:
+		count_stat('misses')
+		set_cache_entry(url, {
+			'blob': blob_hash,
+			'size': len(body),
+			'etag': etag,
+			'last_modified': last_modified,
+			'fetched': time.time(),
+			'accessed': time.time()
+		})
+		evict_cache_entries()
+		CACHE_UNSAVED_STORES += 1
+		if CACHE_UNSAVED_STORES >= CACHE_SAVE_INTERVAL:
+			save_cache_index()
+
+
+# evict_cache_entries: once the unique blobs go over CACHE_BYTE_BUDGET, drops the least recently used entries until they're back
+# down to CACHE_EVICTION_TARGET of it; their blobs get deleted the next time the index is saved (see delete_cache_blobs),
+# once it's certain no other process's entries point to them; callers should be holding CACHE_LOCK
+def evict_cache_entries():
+	if CACHE_BYTES <= CACHE_BYTE_BUDGET:
+		return
+	cache_index = load_cache_index()
+	for url in sorted(cache_index, key = lambda url: cache_index[url]['accessed']):
+		if CACHE_BYTES <= CACHE_BYTE_BUDGET * CACHE_EVICTION_TARGET:
+			break
+		set_cache_entry(url, None)
+		count_stat('evicted')
+
+
+# get_font: loads the font at font_filepath in size font_size, only parsing each (path, size) pair again once it's been forgotten
+def get_font(font_size, font_filepath = FONT_FILEPATH):
+	font_key = ('Font', font_filepath, font_size)
+	loaded_font = recall_memory(font_key)
+	if loaded_font is None:
+		loaded_font = remember_memory(font_key, ImageFont.truetype(font_filepath, font_size))
+	return loaded_font
+
+
+# get_centered_position: gives the top left corner for text of size text_size to be centered in the outline_rectangle bounding box
+def get_centered_position(outline_rectangle, text_size, height_bonus = FONT_HEIGHT_BONUS):
+	outline_width = outline_rectangle[1][0] - outline_rectangle[0][0]
+	outline_height = outline_rectangle[1][1] - outline_rectangle[0][1]
+	return (
+		outline_rectangle[0][0] + int((outline_width - text_size[0]) / 2),
+		outline_rectangle[0][1] + int((outline_height - text_size[1]) / 2) - height_bonus
+	)
+
+
+# get_text_paste: gives the (source, position, mask) paste (see paste_layer) that draws draw_text in size font_size text with its
+# top left corner at text_position, the same way ImageDraw.text would, but by pasting its cached sprite instead of rasterizing the glyphs again
+def get_text_paste(text_position, draw_text, font_size):
+	text_mask, text_size, text_padding = get_text_sprite(draw_text, font_size)
+	return (TEXT_COLOR, (text_position[0] - text_padding, text_position[1] - text_padding), text_mask)
+
+
+# get_text_sprite: renders draw_text in size font_size while it's remembered, returning its alpha mask, its measured (width, height)
+# and the padding around it in the mask; the padding is there because glyphs can reach a bit outside of the size the font measures
+# for them; sprites count towards MEMORY_BYTE_BUDGET like everything else, so one-off text like a build's creator gets forgotten
+# again while repeated labels like level numbers stay
+def get_text_sprite(draw_text, font_size):
+	sprite_key = ('Sprite', draw_text, font_size)
+	text_sprite = recall_memory(sprite_key)
+	if text_sprite is None:
+		with FONT_LOCK:
+			scaled_font = get_font(font_size)
+			text_size = ImageDraw.Draw(Image.new('L', (1, 1))).textsize(draw_text, scaled_font)
+			text_padding = font_size
+			text_mask = Image.new('L', (text_size[0] + 2 * text_padding, text_size[1] + 2 * text_padding), 0)
+			ImageDraw.Draw(text_mask).text((text_padding, text_padding), draw_text, 255, scaled_font)
+		text_sprite = remember_memory(sprite_key, (text_mask, text_size, text_padding))
+	return text_sprite
+
+
+# get_template_layer: gives the static layer for template_key at scale, only rasterizing its template_operations (rectangles,
+# and centered text like in rasterize_display_list) onto a blank (color image, mask) pair the first time the key comes up at that scale
+# while it's remembered; the layer gets cropped down to whatever was drawn, so it's a (color image, mask, position) triple
+# that pastes in a single paste over just that area, or None if nothing was drawn at all
+def get_template_layer(template_key, template_operations, scale = 1):
+	template_layer = recall_memory(('Template', template_key, scale), False)
+	if template_layer is False:
+		image_size = scale_size(BUILD_IMAGE_DIMENSIONS, scale)
+		template_image = (Image.new('RGB', image_size, (0, 0, 0)), Image.new('L', image_size, 0))
+		for template_operation in template_operations:
+			if template_operation[0] == 'rectangle':
+				outline_rectangle, fill_color, outline_color = template_operation[1:]
+				draw_template_rectangle(template_image, scale_rectangle(outline_rectangle, scale), fill_color, outline_color, scale_size((1,), scale)[0])
+			else:
+				draw_text, outline_rectangle, font_size = template_operation[1:]
+				center_template_text(
+					template_image, scale_rectangle(outline_rectangle, scale), draw_text, scale_size((font_size,), scale)[0], scale_point((FONT_HEIGHT_BONUS,), scale)[0]
+				)
+		template_box = template_image[1].getbbox()
+		template_layer = template_box and (template_image[0].crop(template_box), template_image[1].crop(template_box), template_box[:2])
+		remember_memory(('Template', template_key, scale), template_layer)
+	return template_layer
+
+
+# draw_template_rectangle: draws a rectangle on template_image the same way ImageDraw.rectangle would on the build image,
+# filling in the mask wherever the rectangle is drawn
+def draw_template_rectangle(template_image, outline_rectangle, fill_color, outline_color, outline_width = 1):
+	ImageDraw.Draw(template_image[0]).rectangle(outline_rectangle, fill_color, outline_color, outline_width)
+	ImageDraw.Draw(template_image[1]).rectangle(outline_rectangle, 255 if fill_color else None, 255, outline_width)
+
+
+# center_template_text: like a centered_text operation (see rasterize_display_list), but for template_image; the color image gets solid TEXT_COLOR wherever the text
+# touches and the mask gets how much it covers each pixel, so pasting the layer blends it just like pasting the text would
+def center_template_text(template_image, outline_rectangle, draw_text, font_size, height_bonus = FONT_HEIGHT_BONUS):
+	text_mask, text_size, text_padding = get_text_sprite(draw_text, font_size)
+	text_position = get_centered_position(outline_rectangle, text_size, height_bonus)
+	sprite_position = (text_position[0] - text_padding, text_position[1] - text_padding)
+	template_image[0].paste(TEXT_COLOR, sprite_position, text_mask.point(lambda coverage: 255 if coverage else 0))
+	template_image[1].paste(255, sprite_position, text_mask)
+